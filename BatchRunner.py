@@ -0,0 +1,184 @@
+# Headless simulation runner for throughput tests and batch runs. Runs the same loop as Robot.py (and, with --slam,
+# Slam.py): move the robot, move the particles by the odometry, sense, weight the particles and optionally update the
+# robot map, without any plotting or prompts. Each step is written as a row of a CSV file.
+#
+#     python BatchRunner.py --map BinaryMaps/MD_0_binary.png --steps 500 --particles 1000 --output run.csv
+#     python BatchRunner.py --moves moves.txt --slam --map-log run.maplog
+#
+# A move script is a text file of the move commands of Robot.py (w, a, s, d and combinations such as wd), separated by
+# spaces or newlines; it is repeated if it is shorter than --steps. Without one the robot takes a random walk.
+import argparse
+import csv
+import math
+import random
+import time
+import numpy as np
+
+from Odometry import Odometry
+from ParticleFilter import ParticleFilter
+from Sensor import Sensor
+from TrueMap import TrueMap
+from RangeTable import RangeTable
+from RobotMap import RobotMap
+from ParticleMaps import ParticleMaps
+from ScanMatcher import ScanMatcher
+from Resampling import Resampler
+
+
+# pixel deltas (rows, cols) of the move commands, in units of the move scale
+MOVE_COMMANDS = {'a': (0, -1), 'w': (-1, 0), 's': (1, 0), 'd': (0, 1), 'aw': (-1, -1), 'wa': (-1, -1),
+				'wd': (-1, 1), 'dw': (-1, 1), 'sd': (1, 1), 'ds': (1, 1), 'as': (1, -1), 'sa': (1, -1)}
+RANDOM_WALK_COMMANDS = ['a', 'w', 's', 'd']
+
+CSV_COLUMNS = ['step', 'command', 'moved', 'true_y', 'true_x', 'estimate_y', 'estimate_x', 'error_pixels', 'spread_pixels',
+			'effective_sample_size', 'resampled', 'num_particles', 'seconds']
+
+
+def readMoveScript(path):
+	""" Returns the list of move commands in the file at path, checking that they are all known
+	"""
+	with open(path) as scriptFile:
+		commands = scriptFile.read().lower().split()
+	unknown = sorted(set(commands) - set(MOVE_COMMANDS))
+	if unknown:
+		raise ValueError("Unknown move commands in " + path + ": " + ", ".join(unknown))
+	if not commands:
+		raise ValueError("No move commands in " + path)
+	return commands
+
+
+def moveCommands(steps, script=None):
+	""" Generator of the move command of each step: the script over and over, or a random walk
+	"""
+	for step in range(steps):
+		if script is not None:
+			yield script[step % len(script)]
+		else:
+			yield random.choice(RANDOM_WALK_COMMANDS)
+
+
+def run(args):
+	""" Runs the simulation described by the parsed command line arguments and writes one CSV row per step.
+		Returns a summary dict of the run.
+	"""
+	random.seed(args.seed)
+	np.random.seed(args.seed)
+	script = readMoveScript(args.moves) if args.moves else None
+
+	the_map = TrueMap(floorplan=args.map, plan_scale=args.scale, tiled=args.tiled)
+	sensor = Sensor(the_map)
+	if args.range_table:
+		sensor.useRangeTable(RangeTable(the_map, sensor).load())  # true ranges are looked up instead of cast
+	odom = Odometry(the_map, start_x=args.start_x, start_y=args.start_y)
+	part_filt = ParticleFilter(the_map, sensor, odom, numParticles=args.particles, measurementModel=args.measurement_model,
+		resampling=args.resampling, adaptive=args.adaptive, numWorkers=args.workers)
+	if args.global_localization:
+		part_filt.initializeParticles()
+	else:
+		part_filt.initParticlesSpecific(args.start_x, args.start_y)
+
+	the_robot_map = None
+	scan_matcher = None
+	map_log = None
+	if args.slam or args.per_particle_maps:
+		if args.per_particle_maps:
+			the_robot_map = ParticleMaps(part_filt, posteriorProb=the_map.getOccupancyFraction(), dimensions=the_map.getDimensions(),
+				plan_scale=the_map.getScale())
+		else:
+			the_robot_map = RobotMap(part_filt, posteriorProb=the_map.getOccupancyFraction(), dimensions=the_map.getDimensions(),
+				plan_scale=the_map.getScale())
+			if args.scan_match:
+				scan_matcher = ScanMatcher(the_robot_map)
+			if args.map_log:
+				map_log = the_robot_map.createLog(args.map_log)
+	sensor_angles = sensor.getSensorAngles()
+
+	errors = []
+	startTime = time.time()
+	with open(args.output, 'wb') as outputFile:
+		writer = csv.writer(outputFile)
+		writer.writerow(CSV_COLUMNS)
+
+		for step, command in enumerate(moveCommands(args.steps, script)):
+			stepStart = time.time()
+			delta = MOVE_COMMANDS[command]
+			odomMeasure = odom.updatePosition((delta[0] * args.move_scale, delta[1] * args.move_scale))
+			if odomMeasure is not None:
+				part_filt.moveParticles(odomMeasure)
+
+			sensor_readings = sensor.getNoisyDistances(odom.getActualPosition())
+			part_filt.weightParticles(sensor_readings)
+
+			if the_robot_map is not None:
+				if scan_matcher is not None:
+					matched_pose = scan_matcher.match(sensor_angles, sensor_readings, part_filt.getSupposedLocation(),
+						part_filt.getPoseStatistics().getSpread())
+					the_robot_map.updateMap(sensor_angles, sensor_readings, pose=matched_pose)
+				else:
+					the_robot_map.updateMap(sensor_angles, sensor_readings)
+				if map_log is not None and (step + 1) % args.save_every == 0:
+					the_robot_map.saveDelta(map_log)
+			stepSeconds = time.time() - stepStart
+
+			truePosition = odom.getActualPosition()
+			estimate = part_filt.getSupposedLocation()
+			error = math.hypot(estimate[0] - truePosition[0], estimate[1] - truePosition[1])
+			errors.append(error)
+			stats = part_filt.getStepStats()
+			writer.writerow([step, command, int(odomMeasure is not None), truePosition[0], truePosition[1],
+				"%.3f" % estimate[0], "%.3f" % estimate[1], "%.3f" % error, "%.3f" % part_filt.getPoseStatistics().getSpread(),
+				"%.3f" % stats['ess'], int(stats['resampled']), stats['num_particles'], "%.6f" % stepSeconds])
+
+	totalSeconds = time.time() - startTime
+	if map_log is not None:
+		the_robot_map.saveDelta(map_log)
+	if the_robot_map is not None and args.map_output:
+		np.save(args.map_output, the_robot_map.getMap())
+	part_filt.close()
+
+	return {'steps': args.steps, 'seconds': totalSeconds, 'steps_per_second': args.steps / totalSeconds if totalSeconds else float('inf'),
+			'mean_error_pixels': float(np.mean(errors)) if errors else 0.0, 'final_error_pixels': errors[-1] if errors else 0.0}
+
+
+def parseArguments(argv=None):
+	parser = argparse.ArgumentParser(description="Run the robot simulation without visualization, writing per-step results to a CSV file")
+	parser.add_argument('--map', default='BinaryMaps/MD_MINI_binary.png', help="binary floorplan")
+	parser.add_argument('--scale', type=float, default=.04805, help="meters per pixel of the floorplan")
+	parser.add_argument('--tiled', action='store_true', help="read the floorplan tile by tile (for very large maps)")
+	parser.add_argument('--start-x', type=int, default=170, help="starting column of the robot")
+	parser.add_argument('--start-y', type=int, default=150, help="starting row of the robot")
+	parser.add_argument('--moves', default=None, help="move script file (default: random walk)")
+	parser.add_argument('--move-scale', type=int, default=7, help="pixels per move command")
+	parser.add_argument('--steps', type=int, default=100, help="number of steps to run")
+	parser.add_argument('--particles', type=int, default=1000, help="number of particles (maximum when adaptive)")
+	parser.add_argument('--global-localization', action='store_true', help="spread the particles over the whole map instead of the start pose")
+	parser.add_argument('--measurement-model', choices=['beam', 'likelihood'], default='beam')
+	parser.add_argument('--resampling', choices=Resampler.METHODS, default='systematic', help="resampling method")
+	parser.add_argument('--adaptive', action='store_true', help="adapt the particle count with KLD-sampling")
+	parser.add_argument('--workers', type=int, default=1, help="processes used to weight the particles")
+	parser.add_argument('--range-table', action='store_true', help="look true ranges up in a precomputed range table")
+	parser.add_argument('--slam', action='store_true', help="build a robot map from the particle mean")
+	parser.add_argument('--per-particle-maps', action='store_true', help="build one robot map per particle (FastSLAM style)")
+	parser.add_argument('--scan-match', action='store_true', help="refine the pose with the scan matcher before map updates (--slam, experimental)")
+	parser.add_argument('--map-log', default=None, help="append the robot map's changes to this map log (--slam)")
+	parser.add_argument('--save-every', type=int, default=10, help="steps between map log saves")
+	parser.add_argument('--map-output', default=None, help="save the final robot map's wall probabilities to this .npy file")
+	parser.add_argument('--output', default='batch_run.csv', help="per-step CSV output")
+	parser.add_argument('--seed', type=int, default=0, help="random seed")
+	args = parser.parse_args(argv)
+
+	# the scan matcher and the map log work on the single robot map of --slam
+	for flag, value in [('--scan-match', args.scan_match), ('--map-log', args.map_log)]:
+		if value and args.per_particle_maps:
+			parser.error(flag + " cannot be combined with --per-particle-maps")
+		if value and not args.slam:
+			parser.error(flag + " requires --slam")
+	if args.save_every < 1:
+		parser.error("--save-every must be at least 1")
+	return args
+
+
+if __name__ == '__main__':
+	summary = run(parseArguments())
+	print "Ran", summary['steps'], "steps in %.2f seconds (%.1f steps per second)" % (summary['seconds'], summary['steps_per_second'])
+	print "Mean localization error: %.2f pixels, final: %.2f pixels" % (summary['mean_error_pixels'], summary['final_error_pixels'])
@@ -0,0 +1,170 @@
+# Sparse, unbounded 2D grid stored as fixed-size square chunks that are only allocated when first written. Cells
+# that were never written read as FILL. Coordinates are [row, col] pixels and may be negative, so the grid can
+# grow in every direction; memory is only spent on the chunks that contain written cells.
+#
+# Grids can share chunks: copy() makes a new grid referencing the same chunks, and a shared chunk is only copied when
+# one of the grids writes to it. Chunks are reference counted (in a table all the copies share) so that a chunk
+# held by a single grid is written in place; release() drops a grid's references once it is no longer needed.
+#
+# Every write bumps the grid's version and stamps the chunks it touched with it, so any number of readers (a display,
+# a MapLog on disk) can each ask for just the chunks changed since the version they last saw.
+import numpy as np
+
+
+class ChunkedGrid:
+
+	def __init__(self, fill=0, dtype=np.int16, chunkSize=64):
+		self.FILL = fill
+		self.DTYPE = dtype
+		self.CHUNK_SIZE = chunkSize
+		self.CHUNKS = {}  # (chunk row, chunk col) -> (chunkSize, chunkSize) np array
+		self.REF_COUNTS = {}  # id of a chunk -> number of grids holding it, shared by all copies of the grid
+		self.VERSION = 0  # number of writes so far
+		self.MODIFIED = {}  # (chunk row, chunk col) -> version of the last write to the chunk
+
+
+	def groupByChunk(self, rows, cols):
+		""" Sorts cells by chunk. Returns the sort order, the chunk row and col of each sorted cell, their
+			row and col within the chunk, and the start of each chunk's run of cells (plus the end).
+		"""
+		chunkRows, cellRows = np.divmod(np.asarray(rows), self.CHUNK_SIZE)
+		chunkCols, cellCols = np.divmod(np.asarray(cols), self.CHUNK_SIZE)
+		order = np.lexsort((chunkCols, chunkRows))
+		chunkRows, chunkCols = chunkRows[order], chunkCols[order]
+		newChunk = np.flatnonzero((np.diff(chunkRows) != 0) | (np.diff(chunkCols) != 0)) + 1
+		bounds = np.concatenate(([0], newChunk, [len(order)]))
+		return order, chunkRows, chunkCols, cellRows[order], cellCols[order], bounds
+
+
+	def getChunk(self, chunkRow, chunkCol, create=False):
+		""" Returns the chunk, or None for a chunk that was never written. With create set the chunk is returned
+			ready for writing: allocated if it did not exist, and copied first if other grids share it.
+		"""
+		chunk = self.CHUNKS.get((chunkRow, chunkCol))
+		if not create:
+			return chunk
+
+		self.MODIFIED[(chunkRow, chunkCol)] = self.VERSION
+		if chunk is None:
+			chunk = np.full((self.CHUNK_SIZE, self.CHUNK_SIZE), self.FILL, dtype=self.DTYPE)
+		elif self.REF_COUNTS[id(chunk)] > 1:
+			self.REF_COUNTS[id(chunk)] -= 1
+			chunk = chunk.copy()
+		else:
+			return chunk
+		self.CHUNKS[(chunkRow, chunkCol)] = chunk
+		self.REF_COUNTS[id(chunk)] = 1
+		return chunk
+
+
+	def copy(self):
+		""" Returns a grid with the same cells, sharing this grid's chunks until either grid writes to them.
+			Costs O(number of chunks), not O(cells).
+		"""
+		grid = ChunkedGrid(self.FILL, self.DTYPE, self.CHUNK_SIZE)
+		grid.CHUNKS = dict(self.CHUNKS)
+		grid.REF_COUNTS = self.REF_COUNTS
+		grid.VERSION = self.VERSION
+		grid.MODIFIED = dict(self.MODIFIED)
+		for chunk in self.CHUNKS.values():
+			self.REF_COUNTS[id(chunk)] += 1
+		return grid
+
+
+	def release(self):
+		""" Drops this grid's chunks, so that grids still sharing them may write to them in place.
+			The grid is empty afterwards.
+		"""
+		for chunk in self.CHUNKS.values():
+			chunkId = id(chunk)
+			self.REF_COUNTS[chunkId] -= 1
+			if not self.REF_COUNTS[chunkId]:
+				del self.REF_COUNTS[chunkId]
+		self.CHUNKS = {}
+		self.MODIFIED = {}
+
+
+	def addClipped(self, rows, cols, values, low, high):
+		""" Adds values to the cells at np arrays of rows and cols and clips the results to [low, high].
+			Each cell must appear at most once.
+		"""
+		if not len(rows):
+			return
+		self.VERSION += 1
+		order, chunkRows, chunkCols, cellRows, cellCols, bounds = self.groupByChunk(rows, cols)
+		values = np.asarray(values)[order]
+		for start, end in zip(bounds[:-1], bounds[1:]):
+			chunk = self.getChunk(int(chunkRows[start]), int(chunkCols[start]), create=True)
+			r, c = cellRows[start:end], cellCols[start:end]
+			chunk[r, c] = np.clip(chunk[r, c] + values[start:end], low, high)
+
+
+	def setChunk(self, chunkRow, chunkCol, values):
+		""" Overwrites a whole chunk with a (chunkSize, chunkSize) array of values, e.g. one read back from a MapLog
+		"""
+		self.VERSION += 1
+		self.getChunk(chunkRow, chunkCol, create=True)[...] = values
+
+
+	def getVersion(self):
+		""" Returns the version of the grid, which every write increments
+		"""
+		return self.VERSION
+
+
+	def getModifiedChunks(self, since=0):
+		""" Returns the sorted list of (chunk row, chunk col) of the chunks written after version since
+		"""
+		return sorted(key for key, version in self.MODIFIED.items() if version > since)
+
+
+	def getChunkRegion(self, chunkRow, chunkCol):
+		""" Returns the region (row_min, row_max, col_min, col_max) a chunk covers
+		"""
+		return (chunkRow * self.CHUNK_SIZE, (chunkRow + 1) * self.CHUNK_SIZE, chunkCol * self.CHUNK_SIZE, (chunkCol + 1) * self.CHUNK_SIZE)
+
+
+	def getExtent(self):
+		""" Returns (row_min, row_max, col_min, col_max), max exclusive, of the allocated chunks.
+			An empty grid has the extent (0, 0, 0, 0).
+		"""
+		if not self.CHUNKS:
+			return (0, 0, 0, 0)
+		keys = np.array(list(self.CHUNKS.keys()))
+		row_min, col_min = keys.min(axis=0) * self.CHUNK_SIZE
+		row_max, col_max = (keys.max(axis=0) + 1) * self.CHUNK_SIZE
+		return (int(row_min), int(row_max), int(col_min), int(col_max))
+
+
+	def getRegion(self, region):
+		""" Returns a dense np array of the cells of region = (row_min, row_max, col_min, col_max), max exclusive.
+			Only the allocated chunks overlapping the region are copied.
+		"""
+		row_min, row_max, col_min, col_max = region
+		dense = np.full((max(row_max - row_min, 0), max(col_max - col_min, 0)), self.FILL, dtype=self.DTYPE)
+		size = self.CHUNK_SIZE
+		# look up the chunk positions in the region, or scan the allocated chunks, whichever are fewer
+		chunkRows = range(row_min // size, -(-row_max // size))
+		chunkCols = range(col_min // size, -(-col_max // size))
+		if len(chunkRows) * len(chunkCols) < len(self.CHUNKS):
+			chunks = [(key, self.CHUNKS[key]) for key in ((r, c) for r in chunkRows for c in chunkCols) if key in self.CHUNKS]
+		else:
+			chunks = self.CHUNKS.items()
+
+		for (chunkRow, chunkCol), chunk in chunks:
+			top, left = chunkRow * size, chunkCol * size
+			r0, r1 = max(top, row_min), min(top + size, row_max)
+			c0, c1 = max(left, col_min), min(left + size, col_max)
+			if r0 < r1 and c0 < c1:
+				dense[r0 - row_min:r1 - row_min, c0 - col_min:c1 - col_min] = chunk[r0 - top:r1 - top, c0 - left:c1 - left]
+		return dense
+
+
+	def getNumChunks(self):
+		return len(self.CHUNKS)
+
+
+	def getNumBytes(self):
+		""" Returns the memory used by the chunks, counting chunks shared with other grids
+		"""
+		return sum(chunk.nbytes for chunk in self.CHUNKS.values())
@@ -0,0 +1,94 @@
+# Compares the speed and accuracy of the beam and likelihood-field measurement models.
+# Run from the top of the repository: python Development/measurement_model_benchmark.py [floorplan]
+import os
+import sys
+import time
+import math
+import random
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Odometry import Odometry
+from ParticleFilter import ParticleFilter
+from Sensor import Sensor
+from TrueMap import TrueMap
+from LikelihoodField import LikelihoodField
+from ParticleWeighting import ParticleWeighting
+
+
+def time_weighting(the_map, sensor, field, numParticles, repeats=5):
+	""" Seconds per weighting step of numParticles random legal positions for each model
+	"""
+	legal = the_map.getLegalIndex()
+	positions = np.column_stack(np.divmod(legal[np.random.randint(len(legal), size=numParticles)], the_map.getDimensions()[1]))
+	reading = sensor.getNoisyDistances(list(positions[0]))
+	probe = ParticleFilter(the_map, sensor, Odometry(the_map))  # only used for its beam model
+
+	startTime = time.time()
+	for i in range(repeats):
+		ParticleWeighting.weigh(probe.beamLogLikelihoods(positions, reading))
+	beamTime = (time.time() - startTime) / repeats
+
+	startTime = time.time()
+	for i in range(repeats):
+		ParticleWeighting.weigh(field.logLikelihoods(positions, reading))
+	fieldTime = (time.time() - startTime) / repeats
+
+	return beamTime, fieldTime
+
+
+def localization_error(the_map, measurementModel, initx, inity, numParticles=500, steps=40, seed=0):
+	""" Runs a random walk with a fixed seed and returns the mean distance (in pixels) between the particle
+		mean and the true position over the second half of the run, along with the seconds per step.
+	"""
+	random.seed(seed)
+	np.random.seed(seed)
+
+	sensor = Sensor(the_map)
+	odom = Odometry(the_map, start_x=initx, start_y=inity)
+	part_filt = ParticleFilter(the_map, sensor, odom, numParticles=numParticles, measurementModel=measurementModel)
+	part_filt.initializeParticles()
+
+	scale = 7
+	moves = [(0, -scale), (-scale, 0), (scale, 0), (0, scale)]
+	errors = []
+	startTime = time.time()
+	for step in range(steps):
+		odomMeasure = odom.updatePosition(random.choice(moves))
+		if odomMeasure is not None:
+			part_filt.moveParticles(odomMeasure)
+		part_filt.weightParticles(sensor.getNoisyDistances(odom.getActualPosition()))
+
+		mean_y, mean_x = part_filt.getSupposedLocation()
+		true_y, true_x = odom.getActualPosition()
+		errors.append(math.sqrt((mean_y - true_y) ** 2 + (mean_x - true_x) ** 2))
+	stepTime = (time.time() - startTime) / steps
+
+	return np.mean(errors[steps // 2:]), stepTime
+
+
+if __name__ == '__main__':
+	floorplan = sys.argv[1] if len(sys.argv) > 1 else 'BinaryMaps/MD_MINI_binary.png'
+	the_map = TrueMap(floorplan=floorplan)
+	sensor = Sensor(the_map)
+	field = LikelihoodField(the_map, sensor)
+
+	print
+	print "Weighting time per step (seconds)"
+	print "%12s %12s %12s %8s" % ("particles", "beam", "likelihood", "speedup")
+	for numParticles in [100, 1000, 10000]:
+		beamTime, fieldTime = time_weighting(the_map, sensor, field, numParticles)
+		print "%12d %12.5f %12.5f %8.1f" % (numParticles, beamTime, fieldTime, beamTime / fieldTime)
+
+	print
+	print "Localization accuracy (mean error in pixels over the second half of a seeded random walk)"
+	print "%12s %12s %12s" % ("model", "error", "sec/step")
+	for measurementModel in ['beam', 'likelihood']:
+		errors = []
+		stepTimes = []
+		for seed in range(3):
+			error, stepTime = localization_error(the_map, measurementModel, 170, 150, seed=seed)
+			errors.append(error)
+			stepTimes.append(stepTime)
+		print "%12s %12.2f %12.5f" % (measurementModel, np.mean(errors), np.mean(stepTimes))
@@ -0,0 +1,58 @@
+# Times particle weighting with 1 to N worker processes and checks that every worker count gives bit-for-bit the
+# same weights as a single process. Run from the top of the repository:
+#     python Development/parallel_scaling_benchmark.py [floorplan] [numParticles] [maxWorkers]
+import os
+import sys
+import time
+import random
+import multiprocessing
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Odometry import Odometry
+from ParticleFilter import ParticleFilter
+from Sensor import Sensor
+from TrueMap import TrueMap
+
+
+def time_weighting(the_map, numParticles, numWorkers, measurementModel, repeats=3, seed=0):
+	""" Returns the best-of-repeats seconds per weightParticles call and the resulting particles and weights.
+		Resampling is disabled so that only the weighting is timed.
+	"""
+	random.seed(seed)
+	np.random.seed(seed)
+	sensor = Sensor(the_map)
+	odom = Odometry(the_map)
+	part_filt = ParticleFilter(the_map, sensor, odom, numParticles=numParticles, measurementModel=measurementModel,
+		resampleThreshold=0, numWorkers=numWorkers)
+	part_filt.initializeParticles()
+	reading = sensor.getNoisyDistances(list(part_filt.getParticleLocations()[0]))
+
+	best = float('inf')
+	for i in range(repeats):
+		startTime = time.time()
+		part_filt.weightParticles(reading)
+		best = min(best, time.time() - startTime)
+
+	result = (part_filt.getParticleLocations().copy(), part_filt.getParticleWeights().copy())
+	part_filt.close()
+	return best, result
+
+
+if __name__ == '__main__':
+	floorplan = sys.argv[1] if len(sys.argv) > 1 else 'BinaryMaps/MD_0_binary.png'
+	numParticles = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+	maxWorkers = int(sys.argv[3]) if len(sys.argv) > 3 else multiprocessing.cpu_count()
+	the_map = TrueMap(floorplan=floorplan)
+
+	for measurementModel in ['beam', 'likelihood']:
+		print
+		print "Weighting", numParticles, "particles with the", measurementModel, "model"
+		print "%8s %12s %8s %14s" % ("workers", "seconds", "speedup", "identical")
+		serialTime, serialResult = time_weighting(the_map, numParticles, 1, measurementModel)
+		print "%8d %12.4f %8.2f %14s" % (1, serialTime, 1.0, True)
+		for numWorkers in range(2, maxWorkers + 1):
+			workerTime, result = time_weighting(the_map, numParticles, numWorkers, measurementModel)
+			identical = np.array_equal(result[0], serialResult[0]) and np.array_equal(result[1], serialResult[1])
+			print "%8d %12.4f %8.2f %14s" % (numWorkers, workerTime, serialTime / workerTime, identical)
@@ -0,0 +1,62 @@
+# Compares the rays per second of the flat grid traversal and of empty-space skipping over an occupancy pyramid,
+# and checks that both give exactly the same distances. Run from the top of the repository:
+#     python Development/ray_casting_benchmark.py [numOrigins] [floorplan ...]
+import os
+import sys
+import time
+import math
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from OccupancyPyramid import OccupancyPyramid
+from RayCaster import RayCaster
+from TrueMap import TrueMap
+
+
+def rays_per_second(cast, numRays, repeats=3):
+	""" Returns the best-of-repeats rays per second of cast() and its result
+	"""
+	best = float('inf')
+	for i in range(repeats):
+		startTime = time.time()
+		result = cast()
+		best = min(best, time.time() - startTime)
+	return numRays / best, result
+
+
+if __name__ == '__main__':
+	numOrigins = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+	floorplans = sys.argv[2:] or ['BinaryMaps/MD_0_binary.png', 'BinaryMaps/PH_1_binary.png']
+	max_t = 8 / .04805  # the sensor's range in pixels
+
+	for floorplan in floorplans:
+		np.random.seed(0)
+		the_map = TrueMap(floorplan=floorplan)
+		grid = the_map.getTrueMap()
+		origins = the_map.sampleLegalPositions(numOrigins)
+		# random directions, and multiples of 45 degrees and slopes of 1/2, whose rays from cell centers pass
+		# exactly through cell corners, where the casters must decide ties the same way
+		angles = np.concatenate((np.random.uniform(-math.pi, math.pi, 16), np.radians(np.arange(0, 360, 45)),
+								np.arctan2([1, 1, -1, -1, 2, 2, -2, -2], [2, -2, 2, -2, 1, -1, 1, -1])))
+		directions = np.column_stack((-np.sin(angles), np.cos(angles)))
+		numDirections = len(directions)
+		numRays = len(origins) * numDirections
+
+		print
+		print floorplan, grid.shape, len(origins), "origins x", numDirections, "directions"
+		print "%-22s %14s %10s %16s" % ("caster", "rays/second", "speedup", "max difference")
+		flatRate, flat = rays_per_second(lambda: RayCaster.castRays(grid, origins, directions, max_t), numRays)
+		print "%-22s %14.0f %10.2f %16s" % ("flat", flatRate, 1.0, "-")
+		for numLevels in [4, 6, 8]:
+			pyramid = OccupancyPyramid(grid, numLevels)
+			rate, result = rays_per_second(lambda: RayCaster.castRaysPyramid(pyramid, origins, directions, max_t), numRays)
+			print "%-22s %14.0f %10.2f %16.2e" % ("pyramid, %d levels" % numLevels, rate, rate / flatRate, np.max(np.abs(result - flat)))
+
+		# the scalar casters, as used by Sensor.getTrueDistances
+		pyramid = OccupancyPyramid(grid)
+		few = origins[:500]
+		rate, result = rays_per_second(lambda: [RayCaster.castRay(grid, o, d, max_t) for o in few for d in directions], len(few) * numDirections)
+		pyramidRate, result = rays_per_second(lambda: [RayCaster.castRayPyramid(pyramid, o, d, max_t) for o in few for d in directions], len(few) * numDirections)
+		print "%-22s %14.0f %10.2f" % ("scalar flat", rate, 1.0)
+		print "%-22s %14.0f %10.2f %16.2e" % ("scalar pyramid", pyramidRate, pyramidRate / rate, np.max(np.abs(np.array(result) - flat[:len(few)].ravel())))
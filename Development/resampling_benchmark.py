@@ -0,0 +1,52 @@
+# Times each resampling strategy over a range of particle counts and checks that the cost grows linearly.
+# Run from the top of the repository: python Development/resampling_benchmark.py
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Resampling import Resampler
+
+
+def time_resampling(method, numParticles, repeats=5):
+	""" Best-of-repeats seconds to resample numParticles particles with random weights and gather
+		them into a new (N,2) buffer, the way ParticleFilter.weightParticles does.
+	"""
+	resample = Resampler.getMethod(method)
+	particles = np.random.randint(0, 1000, size=(numParticles, 2))
+	weights = np.random.random(numParticles)
+	weights /= weights.sum()
+
+	best = float('inf')
+	for i in range(repeats):
+		startTime = time.time()
+		particles[resample(weights, numParticles)]
+		best = min(best, time.time() - startTime)
+	return best
+
+
+if __name__ == '__main__':
+	np.random.seed(0)
+	particleCounts = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+
+	print "Seconds per resampling step"
+	print "%12s" % "particles" + "".join(["%14s" % method for method in Resampler.METHODS])
+	times = dict((method, [time_resampling(method, n) for n in particleCounts]) for method in Resampler.METHODS)
+	for i in range(len(particleCounts)):
+		print "%12d" % particleCounts[i] + "".join(["%14.6f" % times[method][i] for method in Resampler.METHODS])
+
+	# the slope of log(time) against log(N) over the larger counts (where fixed overheads no longer dominate)
+	# should be close to 1 for linear growth
+	print
+	print "Growth exponent (1.0 is linear)"
+	failed = False
+	for method in Resampler.METHODS:
+		slope = np.polyfit(np.log(particleCounts[1:]), np.log(times[method][1:]), 1)[0]
+		failed = failed or slope > 1.25
+		print "%14s %6.2f" % (method, slope)
+
+	if failed:
+		print "FAILED: resampling cost grows faster than linearly"
+		sys.exit(1)
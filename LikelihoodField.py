@@ -0,0 +1,56 @@
+# Likelihood-field measurement model. Instead of casting a ray for every beam, each scan endpoint is projected into
+# the map and scored against a precomputed field of distances to the nearest wall, which is O(1) per beam.
+import numpy as np
+import math
+from scipy import ndimage
+
+
+class LikelihoodField:
+
+	def __init__(self, trueMap, sensor, z_hit=.9, z_rand=.1):
+		self.MAP_OBJ = trueMap
+		self.MAP_DIMS = trueMap.getDimensions()
+		self.MAP_SCALE = trueMap.getScale()
+		self.SIGMA = sensor.getNoise()
+		self.MAX_RANGE = sensor.getMaxRange()
+		self.Z_HIT = z_hit  # weight of the Gaussian around the nearest wall
+		self.Z_RAND = z_rand  # weight of the uniform random-measurement component
+
+		angles = np.asarray(sensor.getSensorAngles())
+		# pixel offset of a scan endpoint per meter of range, in [row, col] form
+		self.ROW_PER_METER = -np.sin(angles) / self.MAP_SCALE
+		self.COL_PER_METER = np.cos(angles) / self.MAP_SCALE
+
+		# Euclidean distance (in meters) from every cell to the nearest wall. Walls are 0. The transform needs the
+		# whole map, so a tiled map is read in full here
+		self.FIELD = ndimage.distance_transform_edt(np.asarray(trueMap.getTrueMap()) != 1) * self.MAP_SCALE
+
+		print "Likelihood field initialized"
+
+
+	def getEndpointDistances(self, positions, sensorReading):
+		""" Takes an (N,2) array of [y, x] positions and a scan, and returns an (N, beams) np array of
+			the distance from each scan endpoint to the nearest wall. Endpoints outside of the map are
+			clamped to its edge.
+		"""
+		positions = np.asarray(positions).reshape(-1, 2)
+		reading = np.asarray(sensorReading, dtype=float)
+
+		rows = np.rint(positions[:, 0, None] + reading * self.ROW_PER_METER).astype(int)
+		cols = np.rint(positions[:, 1, None] + reading * self.COL_PER_METER).astype(int)
+
+		cols, rows = self.MAP_OBJ.imposeMapLimitsArray(cols, rows)
+		return self.FIELD[rows, cols]
+
+
+	def logLikelihoods(self, positions, sensorReading):
+		""" Returns an (N, beams) np array of the log-likelihood of each beam of the scan at each of the (N,2)
+			[y, x] positions, for use with ParticleWeighting. Max-range readings carry no endpoint and
+			contribute 0.
+		"""
+		endpointDistances = self.getEndpointDistances(positions, sensorReading)
+		hitProb = np.exp(-np.square(endpointDistances) / (self.SIGMA ** 2) / 2.0) / math.sqrt(2.0 * math.pi * (self.SIGMA ** 2))
+		logBeamProb = np.log(self.Z_HIT * hitProb + self.Z_RAND / self.MAX_RANGE)
+
+		logBeamProb[:, np.asarray(sensorReading) >= self.MAX_RANGE] = 0.0
+		return logBeamProb
@@ -0,0 +1,113 @@
+# Append-only on-disk log of the changes to a ChunkedGrid, for checkpointing a map during a run and resuming it.
+# Each append writes the chunks changed since the previous append, whole; replaying the log in order (a later copy of
+# a chunk replaces an earlier one) rebuilds the grid, and compacting rewrites the log with one copy of each chunk.
+#
+# File layout: the line "MAPLOG 1", a line of JSON describing the grid (dtype, chunk size, fill value and any metadata
+# of the map's owner), then fixed-size records of (chunk row, chunk col, grid version) as little-endian int64 followed
+# by the chunk's cells in row-major order. A record cut short (e.g. by a crash during an append) is ignored.
+import numpy as np
+import json
+import os
+import struct
+from ChunkedGrid import ChunkedGrid
+
+
+class MapLog:
+
+	MAGIC = "MAPLOG 1\n"
+	RECORD_HEADER = struct.Struct("<qqq")
+
+	def __init__(self, path, grid, metadata=None):
+		""" Opens the log at path for appending the changes of grid, creating it if needed. When the log
+			already exists, grid must be the grid it holds (see replay), so that only later changes are appended.
+		"""
+		self.PATH = path
+		self.CHUNK_SIZE = grid.CHUNK_SIZE
+		self.DTYPE = np.dtype(grid.DTYPE)
+		if os.path.exists(path) and os.path.getsize(path) > 0:
+			with open(path, 'r+b') as logFile:
+				header = MapLog.readHeader(logFile)
+				if header['dtype'] != self.DTYPE.name or header['chunk_size'] != self.CHUNK_SIZE or header['fill'] != grid.FILL:
+					raise ValueError("Map log " + path + " was written for a different grid")
+				# drop a record cut short at the end, which replay ignored, so that appends stay aligned to records
+				recordsStart = logFile.tell()
+				recordSize = MapLog.RECORD_HEADER.size + self.CHUNK_SIZE * self.CHUNK_SIZE * self.DTYPE.itemsize
+				logSize = os.path.getsize(path)
+				completeSize = recordsStart + (logSize - recordsStart) // recordSize * recordSize
+				if completeSize < logSize:
+					logFile.truncate(completeSize)
+			self.METADATA = header['metadata']
+			self.LAST_VERSION = grid.getVersion()
+		else:
+			self.METADATA = metadata or {}
+			with open(path, 'wb') as logFile:
+				MapLog.writeHeader(logFile, grid, self.METADATA)
+			self.LAST_VERSION = 0
+
+
+	@staticmethod
+	def writeHeader(logFile, grid, metadata):
+		header = {'dtype': np.dtype(grid.DTYPE).name, 'chunk_size': grid.CHUNK_SIZE, 'fill': int(grid.FILL), 'metadata': metadata}
+		logFile.write(MapLog.MAGIC)
+		logFile.write(json.dumps(header, sort_keys=True) + "\n")
+
+
+	@staticmethod
+	def readHeader(logFile):
+		if logFile.readline() != MapLog.MAGIC:
+			raise ValueError("Not a map log: " + logFile.name)
+		return json.loads(logFile.readline())
+
+
+	@staticmethod
+	def writeChunks(logFile, grid, keys):
+		for chunkRow, chunkCol in keys:
+			logFile.write(MapLog.RECORD_HEADER.pack(chunkRow, chunkCol, grid.MODIFIED.get((chunkRow, chunkCol), 0)))
+			logFile.write(np.ascontiguousarray(grid.CHUNKS[(chunkRow, chunkCol)], dtype=grid.DTYPE).tobytes())
+
+
+	def append(self, grid):
+		""" Appends the chunks of grid changed since the last append (or all of them, to a new log) and returns
+			how many were written
+		"""
+		keys = grid.getModifiedChunks(self.LAST_VERSION)
+		with open(self.PATH, 'ab') as logFile:
+			MapLog.writeChunks(logFile, grid, keys)
+		self.LAST_VERSION = grid.getVersion()
+		return len(keys)
+
+
+	@staticmethod
+	def replay(path):
+		""" Rebuilds the grid from the log at path. Returns the ChunkedGrid and the log's metadata.
+		"""
+		with open(path, 'rb') as logFile:
+			header = MapLog.readHeader(logFile)
+			grid = ChunkedGrid(fill=header['fill'], dtype=np.dtype(str(header['dtype'])).type, chunkSize=header['chunk_size'])
+			chunkBytes = grid.CHUNK_SIZE * grid.CHUNK_SIZE * np.dtype(grid.DTYPE).itemsize
+			while True:
+				record = logFile.read(MapLog.RECORD_HEADER.size + chunkBytes)
+				if len(record) < MapLog.RECORD_HEADER.size + chunkBytes:
+					break
+				chunkRow, chunkCol, version = MapLog.RECORD_HEADER.unpack_from(record)
+				values = np.frombuffer(record, dtype=grid.DTYPE, offset=MapLog.RECORD_HEADER.size)
+				grid.setChunk(chunkRow, chunkCol, values.reshape(grid.CHUNK_SIZE, grid.CHUNK_SIZE))
+		return grid, header['metadata']
+
+
+	@staticmethod
+	def compact(path):
+		""" Rewrites the log at path as a snapshot, with only the latest copy of each chunk, and returns the
+			number of chunks in it
+		"""
+		grid, metadata = MapLog.replay(path)
+		tmpPath = path + ".tmp" + str(os.getpid())
+		with open(tmpPath, 'wb') as logFile:
+			MapLog.writeHeader(logFile, grid, metadata)
+			MapLog.writeChunks(logFile, grid, sorted(grid.CHUNKS.keys()))
+		os.rename(tmpPath, path)
+		return grid.getNumChunks()
+
+
+	def getMetadata(self):
+		return self.METADATA
@@ -0,0 +1,56 @@
+# Multi-resolution occupancy pyramid for empty-space skipping. Level 0 is the occupancy grid itself and each level
+# above it max-pools 2x2 blocks of the level below, so a 0 cell at level k means the whole 2**k x 2**k block of the
+# map under it is free. The RayCaster uses it to cross open space a block at a time instead of a pixel at a time.
+import numpy as np
+
+
+class OccupancyPyramid:
+
+	def __init__(self, grid, numLevels=6):
+		""" Builds numLevels levels (blocks of up to 2**(numLevels-1) pixels) from a 0/1 occupancy grid.
+			Blocks hanging over the edge of the map only count the map cells they cover.
+		"""
+		self.LEVELS = [np.asarray(grid)]
+		for level in range(1, numLevels):
+			below = self.LEVELS[-1]
+			rows, cols = below.shape
+			if rows == 1 and cols == 1:
+				break
+			padded = np.zeros((rows + rows % 2, cols + cols % 2), dtype=below.dtype)
+			padded[:rows, :cols] = below
+			self.LEVELS.append(padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).max(axis=(1, 3)))
+
+		self.shape = self.LEVELS[0].shape
+		self.NUM_LEVELS = len(self.LEVELS)
+
+
+	def getLevel(self, level):
+		""" Returns the occupancy of the 2**level pixel blocks of the map
+		"""
+		return self.LEVELS[level]
+
+
+	def emptyLevel(self, row, col):
+		""" Returns the coarsest level at which the block containing the free cell (row, col) is entirely free
+		"""
+		level = 0
+		while level + 1 < self.NUM_LEVELS and self.LEVELS[level + 1][row >> (level + 1), col >> (level + 1)] == 0:
+			level += 1
+		return level
+
+
+	def emptyLevels(self, rows, cols):
+		""" Vectorized emptyLevel for np arrays of free cells. Max pooling makes free blocks nest, so the level
+			is the number of coarser levels at which the cell's block is free.
+		"""
+		levels = np.zeros(np.shape(rows), dtype=int)
+		for level in range(1, self.NUM_LEVELS):
+			free = self.LEVELS[level][rows >> level, cols >> level] == 0
+			if not np.any(free):
+				break
+			levels += free
+		return levels
+
+
+	def getNumLevels(self):
+		return self.NUM_LEVELS
@@ -2,6 +2,7 @@
 
 import random
 import math
+from RayCaster import RayCaster
 
 class Odometry:
 
@@ -19,13 +20,18 @@ class Odometry:
 
 	# Updates the actual pose based on a movement command and returns a pose delta based on noisy odometry data.
 	# Delta should be a list of the values to add to the current pose [y, x]
-	# Returns None if the move would put the robot through a wall.
+	# Returns None if the move would put the robot through a wall (or off the map).
 	def updatePosition(self, delta):
 		dy = delta[0]
 		dx = delta[1]
 
-		if self.TRUE_MAP[self.actualPosition[0] + dy][self.actualPosition[1] + dx] == 1:
-			return None 
+		# check every cell swept between the centers of the current and new cells, not just the destination
+		map_rows, map_cols = self.TRUE_MAP.shape
+		start = (self.actualPosition[0] + .5, self.actualPosition[1] + .5)
+		end = (start[0] + dy, start[1] + dx)
+		for row, col in RayCaster.traverse(start, end):
+			if row < 0 or row >= map_rows or col < 0 or col >= map_cols or self.TRUE_MAP[row, col] == 1:
+				return None
 
 		self.actualPosition[0] += dy
 		self.actualPosition[1] += dx
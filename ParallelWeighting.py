@@ -0,0 +1,77 @@
+# Multi-core particle weighting. Particles are split into contiguous shards and each shard's log-likelihoods are
+# computed by a worker of a process pool. The large read-only arrays the measurement models use (the occupancy grid,
+# the likelihood field) are placed in shared memory before the pool is forked, so workers map them instead of having
+# them pickled every step; precomputed range tables are already shared through their memory map.
+#
+# Weighting is deterministic and the shards are put back together in order, so results are bit-for-bit identical
+# to weighting in a single process. Particle motion stays in the main process: it is a single vectorized draw, and
+# keeping it there keeps the random number stream (and so seeded runs) the same with any number of workers.
+import numpy as np
+import math
+import ctypes
+import multiprocessing
+from multiprocessing import sharedctypes
+
+
+# measurement model installed in each worker when the pool starts. Workers are forked, so the function (and the
+# objects it is bound to) are inherited rather than pickled
+_WORKER_LOG_LIKELIHOODS = None
+
+def _initWorker(measurementLogLikelihoods):
+	global _WORKER_LOG_LIKELIHOODS
+	_WORKER_LOG_LIKELIHOODS = measurementLogLikelihoods
+
+def _shardLogLikelihoods(args):
+	positions, sensorReading = args
+	return _WORKER_LOG_LIKELIHOODS(positions, sensorReading)
+
+
+class ParallelWeighter:
+
+	def __init__(self, measurementLogLikelihoods, numWorkers=None, minShardSize=1000):
+		self.NUM_WORKERS = numWorkers or multiprocessing.cpu_count()
+		self.MIN_SHARD_SIZE = minShardSize  # below this many particles per worker the pool costs more than it saves
+		self.MEASUREMENT_LOG_LIKELIHOODS = measurementLogLikelihoods
+		self.POOL = multiprocessing.Pool(self.NUM_WORKERS, initializer=_initWorker, initargs=(measurementLogLikelihoods,))
+
+		print "Parallel weighting initialized with", self.NUM_WORKERS, "workers"
+
+
+	@staticmethod
+	def sharedCopy(array):
+		""" Returns a copy of a np array backed by anonymous shared memory, which processes forked afterwards
+			map instead of copying.
+		"""
+		array = np.ascontiguousarray(array)
+		shared = sharedctypes.RawArray(ctypes.c_char, max(array.nbytes, 1))
+		view = np.frombuffer(shared, dtype=array.dtype, count=array.size).reshape(array.shape)
+		view[...] = array
+		return view
+
+
+	@staticmethod
+	def shareArrays(owner, attributeNames):
+		""" Replaces each named np array attribute of owner with a shared memory copy of itself
+		"""
+		for name in attributeNames:
+			setattr(owner, name, ParallelWeighter.sharedCopy(getattr(owner, name)))
+
+
+	def logLikelihoods(self, positions, sensorReading):
+		""" Same as the measurement model: returns the (N, beams) log-likelihoods of the scan at each of the
+			(N,2) positions, with the positions split across the pool.
+		"""
+		numShards = min(self.NUM_WORKERS, int(math.ceil(len(positions) / float(self.MIN_SHARD_SIZE))))
+		if numShards <= 1:
+			return self.MEASUREMENT_LOG_LIKELIHOODS(positions, sensorReading)
+
+		shards = np.array_split(positions, numShards)
+		results = self.POOL.map(_shardLogLikelihoods, [(shard, sensorReading) for shard in shards])
+		return np.concatenate(results)
+
+
+	def close(self):
+		""" Shuts down the worker processes
+		"""
+		self.POOL.terminate()
+		self.POOL.join()
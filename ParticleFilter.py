@@ -1,17 +1,19 @@
 import numpy as np
-import random
-import copy
-from numpy.random import choice
-from numpy import ndarray
 import math
+from LikelihoodField import LikelihoodField
+from Resampling import Resampler
+from ParticleWeighting import ParticleWeighting
+from ParallelWeighting import ParallelWeighter
+from PoseStatistics import PoseStatistics
 
 class ParticleFilter:
 
-	def __init__(self, trueMap, sensor, odometer, numParticles=1000):
+	def __init__(self, trueMap, sensor, odometer, numParticles=1000, measurementModel='beam', resampling='systematic',
+				adaptive=False, minParticles=100, kldEpsilon=.05, kldDelta=.01, kldBinSize=10, resampleThreshold=.5,
+				numWorkers=1):
 		self.NUM_PARTICLES = numParticles
 		self.TRUE_MAP = trueMap.getTrueMap()
-		self.legalPositions = trueMap.getLegalPositions()
-		self.NUM_LEGAL_POS = len(self.legalPositions)
+		self.NUM_LEGAL_POS = trueMap.getNumLegalPositions()
 		self.MOVEMENT_MODEL = odometer.getError()
 		self.MAP_SCALE = trueMap.getScale()
 		self.TRUE_SENSOR = sensor #for assigning weights to particles when wall locations are known
@@ -19,135 +21,232 @@ class ParticleFilter:
 		self.MAP_DIMS = trueMap.getDimensions()
 		self.MAP_OBJ = trueMap
 		
-		self.Particles = []  # characeristics of a particle: [position, ...]
+		# particles are stored as a structure of arrays: an (N,2) array of [row, col] positions and an (N,) array
+		# of normalized weights, one entry per particle
+		self.Particles = np.zeros((0, 2), dtype=int)
+		self.Weights = np.zeros(0)
+
+		# PoseStatistics of the current particles, computed on first use after each update (see getPoseStatistics)
+		self.POSE_STATS = None
+
+		# measurement model used to weight particles:
+		# 'beam' compares the scan to rays cast from each particle (see beamLogLikelihoods)
+		# 'likelihood' scores each scan endpoint against the distance to the nearest wall (see LikelihoodField)
+		# or any function (positions, sensorReading) -> (N, beams) array of log-likelihoods
+		self.LIKELIHOOD_FIELD = None
+		if measurementModel == 'beam':
+			self.MEASUREMENT_LOG_LIKELIHOODS = self.beamLogLikelihoods
+		elif measurementModel == 'likelihood':
+			self.LIKELIHOOD_FIELD = LikelihoodField(trueMap, sensor)
+			self.MEASUREMENT_LOG_LIKELIHOODS = self.LIKELIHOOD_FIELD.logLikelihoods
+		elif callable(measurementModel):
+			self.MEASUREMENT_LOG_LIKELIHOODS = measurementModel
+		else:
+			raise ValueError("Unknown measurement model: " + str(measurementModel))
+		self.MEASUREMENT_MODEL = measurementModel
+
+		# with more than one worker, weighting is sharded across a process pool (see ParallelWeighter). The pool is
+		# forked here, so the sensor (and its range table) must be fully set up before the filter is created
+		self.PARALLEL_WEIGHTER = None
+		if numWorkers > 1:
+			# a tiled map is read from its memory-mapped tile store, which the workers share already
+			if not trueMap.isTiled():
+				ParallelWeighter.shareArrays(sensor, ['TRUE_MAP'])
+				sensor.PYRAMID.LEVELS = [sensor.TRUE_MAP] + [ParallelWeighter.sharedCopy(level) for level in sensor.PYRAMID.LEVELS[1:]]
+			if self.LIKELIHOOD_FIELD is not None:
+				ParallelWeighter.shareArrays(self.LIKELIHOOD_FIELD, ['FIELD'])
+			self.PARALLEL_WEIGHTER = ParallelWeighter(self.MEASUREMENT_LOG_LIKELIHOODS, numWorkers)
+
+		# resampling strategy, one of Resampler.METHODS: 'systematic', 'stratified', 'residual' or 'multinomial'
+		self.RESAMPLING = resampling
+		self.RESAMPLE = Resampler.getMethod(resampling)
+
+		# KLD-sampling adaptive particle count. When adaptive, numParticles is the maximum particle count and each
+		# resampling keeps just enough particles for the KLD bound (error kldEpsilon with probability 1 - kldDelta)
+		# over a histogram of particle positions with kldBinSize x kldBinSize pixel bins
+		self.ADAPTIVE = adaptive
+		self.MAX_PARTICLES = numParticles
+		self.MIN_PARTICLES = min(minParticles, numParticles)
+		self.KLD_EPSILON = kldEpsilon
+		self.KLD_DELTA = kldDelta
+		self.KLD_BIN_SIZE = kldBinSize
+		self.KLD_BIN_COLS = self.MAP_DIMS[1] // kldBinSize + 1
+
+		# weights carry over between updates and the particles are only resampled once the effective sample size
+		# drops below resampleThreshold * NUM_PARTICLES (1 resamples whenever the weights are not uniform)
+		self.RESAMPLE_THRESHOLD = resampleThreshold
+		self.STEP_STATS = {'updates': 0, 'resamples': 0, 'resampled': False, 'ess': 0.0, 'num_particles': 0}
+		# index (before resampling) of the particle each particle was drawn from at the last resampling
+		self.ANCESTORS = None
 
 		print "Particle filter initialized"
 
 
-	def initializeParticles(self):
-		""" Initializes a list of particles, where each particle is a list of positions and other features, 
-		    and a particle's position is a list of the form [row,col] (or [y,x])
+	def initializeParticles(self, region=None, prior=None):
+		""" Initializes the particles, where a particle's position is a row of self.Particles of the form [row,col] (or [y,x])
 
 			Each particle position is a pixel location (equivalently, an element in the map matrix)
 
-			If the number of legal positions is less than the default number of particles 'numParticles'
-			then it redefines self.NUM_PARTICLES and distributes these uniformly only into legal positions
-			(positions with no wall or obstacles)
+			If the number of legal positions is less than the number of particles 'numParticles'
+			then this initialization uses one particle per legal position (positions with no wall or obstacles).
+			The configured count is kept for later initializations.
 
 			Otherwise it distributes numParticles number of particles randomly only into legal positions
-			(positions with no wall or obstacles.)
-		"""
-		self.Particles = []
+			(positions with no wall or obstacles.), at most one particle per position
 
-		if self.NUM_PARTICLES > self.NUM_LEGAL_POS:
-			self.NUM_PARTICLES = self.NUM_LEGAL_POS
+			Optionally the particles can be restricted to a region = (row_min, row_max, col_min, col_max)
+			(max exclusive) of the map, and/or drawn according to a prior: an array the shape of the map of
+			non-negative weights, where positions with weight 0 are never chosen. Raises ValueError if no
+			legal position is eligible.
+
+			In adaptive mode this is global localization, so it starts from the maximum particle count.
+		"""
+		# numParticles, which is also the maximum count in adaptive mode
+		count = self.MAX_PARTICLES
+
+		if region is None and prior is None:
+			# uniform over the whole map, which the map samples without listing every legal position
+			if not self.NUM_LEGAL_POS:
+				raise ValueError("The map has no legal positions to place particles in")
+			self.NUM_PARTICLES = min(count, self.NUM_LEGAL_POS)
+			self.Particles = self.MAP_OBJ.sampleLegalPositions(self.NUM_PARTICLES)
+			self.Weights = np.full(self.NUM_PARTICLES, 1.0 / self.NUM_PARTICLES)
+			self.POSE_STATS = None
+			return
+
+		map_rows, map_cols = self.MAP_DIMS
+		legal = self.MAP_OBJ.getLegalIndex()
+		if region is not None:
+			row_min, row_max, col_min, col_max = region
+			rows, cols = np.divmod(legal, map_cols)
+			legal = legal[(rows >= row_min) & (rows < row_max) & (cols >= col_min) & (cols < col_max)]
+		if prior is not None:
+			priorWeights = np.asarray(prior, dtype=float).ravel()[legal]
+			legal = legal[priorWeights > 0]
+			priorWeights = priorWeights[priorWeights > 0]
+
+		if not len(legal):
+			raise ValueError("No legal position in the region and prior given to place particles in")
+		self.NUM_PARTICLES = min(count, len(legal))
 
 		# if num of particles is equal to the number of legal positions, then distribute uniformly
 		# else distribute into random legal positions (this is due to a limit on number of particles,
 		# which for most maps will be in the hundreds of thousands)
-		if self.NUM_PARTICLES == self.NUM_LEGAL_POS:
-			for p_row, p_col in self.legalPositions: 
-				# position in positions
-				self.Particles.append([[p_row, p_col]])
+		if self.NUM_PARTICLES == len(legal):
+			chosen = legal
+		elif prior is None:
+			# sample indices without replacement
+			chosen = legal[np.random.permutation(len(legal))[:self.NUM_PARTICLES]]
 		else:
-			# pick a random legal position
-			legal_positions = copy.deepcopy(self.legalPositions)
-			i = 0
-			while i < self.NUM_PARTICLES:
-				p_row, p_col = random.choice(legal_positions)
-				legal_positions.remove((p_row,p_col))
-				self.Particles.append([[p_row, p_col]])
-				i += 1
+			# weighted sampling without replacement (Efraimidis & Spirakis): keep the largest log(u)/w keys
+			keys = np.log(np.random.random(len(legal))) / priorWeights
+			chosen = legal[np.argpartition(-keys, self.NUM_PARTICLES - 1)[:self.NUM_PARTICLES]]
+
+		self.Particles = np.column_stack(np.divmod(chosen, map_cols)).astype(int)
+		self.Weights = np.full(self.NUM_PARTICLES, 1.0 / self.NUM_PARTICLES)
+		self.POSE_STATS = None
 
 
 	def initParticlesSpecific(self, locx, locy):
-		""" Initializes a list of particles to a specific x, y location for use
+		""" Initializes the particles to a specific x, y location for use
 		    in slam.
 
-		    Each particle is a list of positions and other features, 
-		    and a particle's position is a list of the form [row,col] (or [y,x])
+		    A particle's position is a row of self.Particles of the form [row,col] (or [y,x])
 
 			Each particle position is a pixel location (equivalently, an element in the map matrix)
 
-			If the number of legal positions is less than the default number of particles 'numParticles'
-			then it redefines self.NUM_PARTICLES and distributes these uniformly only into legal positions
-			(positions with no wall or obstacles)
-		"""
-		self.Particles = []
+			The particle count is numParticles, or the number of legal positions if that is smaller
 
-		if self.NUM_PARTICLES > self.NUM_LEGAL_POS:
-			self.NUM_PARTICLES = self.NUM_LEGAL_POS
+			In adaptive mode the location is known, so it starts from the minimum particle count.
+		"""
+		count = self.MIN_PARTICLES if self.ADAPTIVE else self.MAX_PARTICLES
+		self.NUM_PARTICLES = min(count, self.NUM_LEGAL_POS)
 
 		# all particle locations will be the same
-		i = 0
-		while i < self.NUM_PARTICLES:
-			self.Particles.append([[locy, locx]])
-			i += 1
+		self.Particles = np.tile(np.array([locy, locx], dtype=int), (self.NUM_PARTICLES, 1))
+		self.Weights = np.full(self.NUM_PARTICLES, 1.0 / self.NUM_PARTICLES)
+		self.POSE_STATS = None
 
 
 	# update particles according to motion model. Update after each robot movement.
 	# Motion model consists of odometry reading probability distribution and legality of new position
 	def moveParticles(self, odometryReading):
-		for i in range(self.NUM_PARTICLES):		
-			
-			dy = random.gauss(odometryReading[0], odometryReading[0] * self.MOVEMENT_MODEL/self.MAP_SCALE)
-			dx = random.gauss(odometryReading[1], odometryReading[1] * self.MOVEMENT_MODEL/self.MAP_SCALE)
-			y_pos = int(self.Particles[i][0][0] + dy + 1)
-			x_pos = int(self.Particles[i][0][1] + dx + 1)
-
-			# Map limits enforced
-			x_pos, y_pos = self.MAP_OBJ.imposeMapLimits(x_pos, y_pos)
+		# one Gaussian draw per particle and axis, the spread grows with the length of the move
+		sigma = np.abs(np.asarray(odometryReading, dtype=float)) * self.MOVEMENT_MODEL/self.MAP_SCALE
+		delta = np.random.normal(odometryReading, sigma, size=(self.NUM_PARTICLES, 2))
 
-			self.Particles[i][0][0] = y_pos
-			self.Particles[i][0][1] = x_pos
+		# truncate back to pixels (astype truncates towards zero like int()) and enforce map limits, in place
+		newPositions = (self.Particles + delta + 1).astype(int)
+		self.Particles[:, 1], self.Particles[:, 0] = self.MAP_OBJ.imposeMapLimitsArray(newPositions[:, 1], newPositions[:, 0])
+		self.POSE_STATS = None
 
 
 	# This is only used for localization when you know the map! Sensor reading is passed to this method to determine
 	# probability of sensor reading given location P(e|X)
 	def weightParticles(self, sensorReading):
-		weight = [0] * self.NUM_PARTICLES
-		for i in range(self.NUM_PARTICLES):
-			y_pos = self.Particles[i][0][0]
-			x_pos = self.Particles[i][0][1]
-			trueRanges = self.TRUE_SENSOR.getTrueDistances([y_pos, x_pos])
-			weight[i] = self.measurement_prob(trueRanges, sensorReading)
+		# (particles x beams) log-likelihoods from the measurement model, added to the log of the weights carried
+		# over from earlier updates and normalized in the log domain
+		if self.PARALLEL_WEIGHTER is not None:
+			logLikelihoods = self.PARALLEL_WEIGHTER.logLikelihoods(self.Particles, sensorReading)
+		else:
+			logLikelihoods = self.MEASUREMENT_LOG_LIKELIHOODS(self.Particles, sensorReading)
+		with np.errstate(divide='ignore'):
+			self.Weights = ParticleWeighting.weigh(logLikelihoods, logPrior=np.log(self.Weights))
+		self.POSE_STATS = None
 
-		norm_weight = [float(i)/sum(weight) for i in weight]
+		effectiveSampleSize = 1.0 / np.sum(np.square(self.Weights))
+		resample = effectiveSampleSize < self.RESAMPLE_THRESHOLD * self.NUM_PARTICLES
 
-		newParticlesIndices = np.random.choice(range(len(self.Particles)), size = self.NUM_PARTICLES, replace = True, p = norm_weight)  # an array
+		self.STEP_STATS['updates'] += 1
+		self.STEP_STATS['resamples'] += int(resample)
+		self.STEP_STATS['resampled'] = resample
+		self.STEP_STATS['ess'] = effectiveSampleSize
+		if resample:
+			self.resampleParticles()
+		self.STEP_STATS['num_particles'] = self.NUM_PARTICLES
 
-		newParticles = []
-		for i in range(len(newParticlesIndices)):
-			newParticles.append(copy.deepcopy(self.Particles[newParticlesIndices[i]]))
-		self.Particles = copy.deepcopy(newParticles)
+
+	def resampleParticles(self):
+		""" Draws a new set of particles according to the weights and resets the weights to uniform.
+		"""
+		if self.ADAPTIVE:
+			binIds = (self.Particles[:, 0] // self.KLD_BIN_SIZE) * self.KLD_BIN_COLS + self.Particles[:, 1] // self.KLD_BIN_SIZE
+			newParticlesIndices = Resampler.kldResample(self.RESAMPLE, self.Weights, binIds, self.KLD_EPSILON, self.KLD_DELTA,
+				self.MIN_PARTICLES, self.MAX_PARTICLES)
+		else:
+			newParticlesIndices = self.RESAMPLE(self.Weights, self.NUM_PARTICLES)  # an array
+
+		# fancy indexing gathers the chosen particles into the one new buffer of the step
+		self.Particles = self.Particles[newParticlesIndices]
+		self.ANCESTORS = newParticlesIndices
+		if len(newParticlesIndices) != self.NUM_PARTICLES:
+			self.NUM_PARTICLES = len(newParticlesIndices)
+			self.Weights = np.empty(self.NUM_PARTICLES)
+		self.Weights.fill(1.0 / self.NUM_PARTICLES)
+		self.POSE_STATS = None
 
 
 	def getParticleLocations(self):
-		""" Only to be used by the visualizer class.
-		    Returns a list of particle locations in (y,x) format
+		""" Returns the (N,2) np array of particle locations in (y,x) format
 
-		    e.g. particleLocations = [(y1,x1), (y2,x2), (y3,x3)]
+		    e.g. particleLocations = [[y1,x1], [y2,x2], [y3,x3]]
+
+		    This is the filter's own storage, not a copy, so it must not be modified.
 		"""
-		particleLocations = []
-		for particle in self.Particles:
-			p_row, p_col = particle[0]
-			particleLocations.append((p_row, p_col))  # appended in (y,x) format
+		return self.Particles
 
-		return particleLocations
 
+	def getAncestors(self):
+		""" Returns the np array of the index each particle had before the last resampling, i.e. the particle it
+			was drawn from, or None if the particles have not been resampled.
+		"""
+		return self.ANCESTORS
 
-	def gaussian(self, mu, sigma, x):
-		""" calculates the probability of x for 1-dim Gaussian with mean mu and var. sigma
-		:param mu:    distance to the landmark
-		:param sigma: standard deviation
-		:param x:     distance to the landmark measured by the robot
-		:return gaussian value
+
+	def getParticleWeights(self):
+		""" Returns the (N,) np array of normalized particle weights. Not a copy, must not be modified.
 		"""
-		# print "mu", mu
-		# print "sigma", sigma
-		# print "x", x
-		# calculates the probability of x for 1-dim Gaussian with mean mu and var. sigma
-		return math.exp(- ((mu - x) ** 2) / (sigma ** 2) / 2.0) / math.sqrt(2.0 * math.pi * (sigma ** 2))
+		return self.Weights
 
 
 	def measurement_prob(self, trueRanges, sensorReading):
@@ -155,71 +254,67 @@ class ParticleFilter:
 		:param measurement: current measurement
 		:return probability
 		"""
+		logLikelihoods = ParticleWeighting.gaussianLogLikelihoods(trueRanges, sensorReading, self.SENSOR_NOISE)
+		return math.exp(np.sum(logLikelihoods))
 
-		prob = 1.0
 
-		for i in range(len(trueRanges)):
-			prob *= self.gaussian(trueRanges[i], self.SENSOR_NOISE, sensorReading[i])
-		return prob
+	def beamLogLikelihoods(self, positions, sensorReading):
+		""" Beam measurement model. Returns the (N, beams) np array of log-likelihoods of each beam of the scan
+			given the true ranges from each of the (N,2) positions.
+		"""
+		# cast the rays of every particle in one batch (or look them up in the range table)
+		allTrueRanges = self.TRUE_SENSOR.getTrueDistancesBatch(positions)
+		return ParticleWeighting.gaussianLogLikelihoods(allTrueRanges, sensorReading, self.SENSOR_NOISE)
 
 	def getNumParticles(self):
 		return self.NUM_PARTICLES
 
+	def getMeasurementModel(self):
+		return self.MEASUREMENT_MODEL
 
-	def getParticleStdDev(self):
-		""" Standard deviation of a particle location using rms distance
-		"""
-		particleList = self.getParticleLocations()
-		yList = [coord[0] for coord in particleList]
-		xList = [coord[1] for coord in particleList]
-		
-		# convert to numpy arrays so that numpy stat methods can be used
-		yarr = np.array(yList)  # yo ho yo ho, a pirate's life for me!
-		xarr = np.array(xList)
-
-		xMu = np.mean(xarr)
-		yMu = np.mean(yarr)
-
-		rms = 0
-		for i in range(len(yarr)):
-			rms += np.square((yarr[i]-yMu)) + np.square((xarr[i] - xMu))
-		rms = math.sqrt(rms/len(yarr))
+	def getResamplingMethod(self):
+		return self.RESAMPLING
 
+	def isAdaptive(self):
+		return self.ADAPTIVE
 
-	def getParticleStdDevDirectional(self, theta):	
-		particleList = self.getParticleLocations()
-		yList = [coord[0] for coord in particleList]
-		xList = [coord[1] for coord in particleList]
-		
-		# convert to numpy arrays so that numpy stat methods can be used
-		yarr = np.array(yList)  # yo ho yo ho, a pirate's life for me!
-		xarr = np.array(xList)
+	def close(self):
+		""" Shuts down the weighting worker processes, if any
+		"""
+		if self.PARALLEL_WEIGHTER is not None:
+			self.PARALLEL_WEIGHTER.close()
+			self.PARALLEL_WEIGHTER = None
+
+	def getStepStats(self):
+		""" Returns a dict of statistics about the filter updates:
+			'updates' and 'resamples' count the calls to weightParticles and how many of them resampled,
+			'resampled', 'ess' and 'num_particles' describe the last update (whether it resampled, the
+			effective sample size before resampling, and the particle count after it).
+		"""
+		return dict(self.STEP_STATS)
 
-		combined = np.array([xarr, yarr])
-		rotationMatrix = np.array([[math.cos(theta), math.sin(theta)],[-math.sin(theta), math.cos(theta)]])  # clockwise rotation
 
-		rotatedPoints = np.matmul(rotationMatrix, combined)  # first row is all x values, second row is all y values
+	def getPoseStatistics(self):
+		""" Returns the PoseStatistics (weighted mean, covariance, spread) of the current particles.
+			They are computed once after each update of the particles and shared by every caller until the next.
+		"""
+		if self.POSE_STATS is None:
+			self.POSE_STATS = PoseStatistics(self.Particles, self.Weights)
+		return self.POSE_STATS
 
-		stdDev = np.std(rotatedPoints[0])  # standard dev of only the x values (aka std deviation in direction of theta)
-		# print "Standard deviation in direction ", theta, ": ", stdDev
-		return stdDev
 
-	def getSupposedLocation(self):
-		""" Returns the average of the particle locations in y,x form
+	def getParticleStdDev(self):
+		""" Standard deviation of a particle location using rms distance
 		"""
-		#
-		particleList = self.getParticleLocations()
-		yList = [coord[0] for coord in particleList]
-		xList = [coord[1] for coord in particleList]
-		
-		# convert to numpy arrays so that numpy stat methods can be used
-		yarr = np.array(yList)  # yo ho yo ho, a pirate's life for me!
-		xarr = np.array(xList)
-
-		mean_x = np.mean(xarr)
-		mean_y = np.mean(yarr)
-		
-		return (mean_y, mean_x)
+		return self.getPoseStatistics().getSpread()
 
 
+	def getParticleStdDevDirectional(self, theta):	
+		""" Standard deviation of the particle locations in the direction of theta
+		"""
+		return self.getPoseStatistics().getDirectionalStdDev(theta)
 
+	def getSupposedLocation(self):
+		""" Returns the weighted average of the particle locations in y,x form
+		"""
+		return self.getPoseStatistics().getMean()
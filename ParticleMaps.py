@@ -0,0 +1,96 @@
+# Per-particle occupancy maps, in the style of Rao-Blackwellized FastSLAM: every particle of the filter carries its
+# own RobotMap, built from the scans as seen from that particle's pose, so a multimodal particle cloud keeps one map
+# per hypothesis instead of blurring them into one map at the mean.
+#
+# The maps share storage. When the filter resamples, each new particle takes a copy-on-write copy of its ancestor's
+# map (see ChunkedGrid.copy), so resampling costs O(chunks per map) per particle and only the chunks a particle
+# then writes to are duplicated.
+import numpy as np
+from RobotMap import RobotMap
+
+
+class ParticleMaps:
+
+	def __init__(self, particleFilter, **mapArgs):
+		""" Creates an empty map for each of the filter's current particles. mapArgs are passed on to RobotMap.
+		"""
+		self.part_filt = particleFilter
+		emptyMap = RobotMap(particleFilter, **mapArgs)
+		self.MAPS = [emptyMap.copy() for i in range(particleFilter.getNumParticles())]
+		# resamplings of the filter the maps have followed so far
+		self.RESAMPLES_SEEN = particleFilter.getStepStats()['resamples']
+
+
+	def followResampling(self):
+		""" Gives each particle a copy of the map of the particle it was drawn from. The first particle drawn from
+			an ancestor takes its map over and the others get copy-on-write copies; the maps of particles that
+			were not drawn are released.
+		"""
+		ancestors = self.part_filt.getAncestors()
+		taken = np.zeros(len(self.MAPS), dtype=bool)
+		newMaps = []
+		for ancestor in ancestors:
+			if taken[ancestor]:
+				newMaps.append(self.MAPS[ancestor].copy())
+			else:
+				newMaps.append(self.MAPS[ancestor])
+				taken[ancestor] = True
+		for i in np.flatnonzero(~taken):
+			self.MAPS[i].release()
+		self.MAPS = newMaps
+		self.RESAMPLES_SEEN = self.part_filt.getStepStats()['resamples']
+
+
+	def updateMap(self, scanAngles, scanRanges):
+		""" Adds the scan to every particle's map, from that particle's pose. Must be called after each
+			weightParticles, so that the maps follow every resampling of the filter.
+		"""
+		if self.part_filt.getStepStats()['resamples'] != self.RESAMPLES_SEEN:
+			self.followResampling()
+
+		angles = np.asarray(scanAngles, dtype=float)
+		ranges = np.asarray(scanRanges, dtype=float)
+		if not len(ranges):
+			return
+
+		# the evidence of all particles is computed at once, with the sensor noise alone: each pose is exact
+		positions = self.part_filt.getParticleLocations().astype(float)
+		robotMap = self.MAPS[0]
+		sigmaTotal = np.full((len(positions), len(angles)), float(robotMap.SENSOR_NOISE))
+		pose, rows, cols, logOdds = robotMap.scanEvidence(angles, ranges, positions, sigmaTotal)
+
+		# then scattered into each particle's map
+		bounds = np.searchsorted(pose, np.arange(len(positions) + 1))
+		for i in range(len(positions)):
+			start, end = bounds[i], bounds[i + 1]
+			self.MAPS[i].addLogOdds(rows[start:end], cols[start:end], logOdds[start:end])
+
+
+	def getBestParticle(self):
+		""" Returns the index of the particle with the highest weight
+		"""
+		return int(np.argmax(self.part_filt.getParticleWeights()))
+
+
+	def getParticleMap(self, particle):
+		""" Returns the RobotMap of a particle
+		"""
+		return self.MAPS[particle]
+
+
+	def getMap(self, region=None):
+		""" Returns the map of the most likely particle (see RobotMap.getMap)
+		"""
+		return self.MAPS[self.getBestParticle()].getMap(region)
+
+
+	def getDisplayMatrix(self, region=None):
+		""" Returns the map of the most likely particle for Visualization.display_a_matrix
+		"""
+		return self.MAPS[self.getBestParticle()].getDisplayMatrix(region)
+
+
+	def getNumChunks(self):
+		""" Returns the number of distinct chunks allocated for all the maps together
+		"""
+		return len(self.MAPS[0].LOG_ODDS.REF_COUNTS)
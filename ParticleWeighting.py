@@ -0,0 +1,49 @@
+# Log-domain particle weighting shared by all measurement models. A measurement model only has to produce an
+# (N particles, beams) matrix of per-beam log-likelihoods; summing over beams and normalizing with log-sum-exp
+# never underflows, however many beams there are.
+import numpy as np
+import math
+
+
+class ParticleWeighting:
+
+	@staticmethod
+	def gaussianLogLikelihoods(expected, observed, sigma):
+		""" Log of the 1-dim Gaussian density of each observed range given the expected range, for an
+			(N, beams) array of expected ranges and a (beams,) scan. Returns an (N, beams) np array.
+		"""
+		error = (np.asarray(expected, dtype=float) - np.asarray(observed, dtype=float)) / sigma
+		return -0.5 * np.square(error) - math.log(math.sqrt(2.0 * math.pi) * sigma)
+
+
+	@staticmethod
+	def logSumExp(logValues):
+		""" log(sum(exp(logValues))) computed without overflow or underflow
+		"""
+		maxLog = np.max(logValues)
+		if not np.isfinite(maxLog):
+			return maxLog
+		return maxLog + math.log(np.sum(np.exp(logValues - maxLog)))
+
+
+	@staticmethod
+	def normalizeLogWeights(logWeights):
+		""" Turns an (N,) array of unnormalized log weights into normalized weights that sum to 1.
+			If every weight is zero (all log weights are -inf) the weights fall back to uniform.
+		"""
+		logNorm = ParticleWeighting.logSumExp(logWeights)
+		if not np.isfinite(logNorm):
+			return np.full(len(logWeights), 1.0 / len(logWeights))
+		return np.exp(logWeights - logNorm)
+
+
+	@staticmethod
+	def weigh(logLikelihoods, logPrior=None):
+		""" Combines an (N, beams) matrix of per-beam log-likelihoods from any measurement model into
+			normalized (N,) particle weights. Beams are assumed independent, so their log-likelihoods add.
+			An optional (N,) array of prior log weights is added before normalizing.
+		"""
+		logWeights = np.sum(logLikelihoods, axis=1)
+		if logPrior is not None:
+			logWeights = logWeights + logPrior
+		return ParticleWeighting.normalizeLogWeights(logWeights)
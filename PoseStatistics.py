@@ -0,0 +1,49 @@
+# Summary statistics of the particle cloud, computed in one pass over the particles after each filter update.
+# Everything the filter and the robot map ask about the pose estimate is then answered from these few numbers.
+import numpy as np
+import math
+
+
+class PoseStatistics:
+
+	def __init__(self, positions, weights):
+		""" Takes the (N,2) array of [y, x] particle positions and their (N,) normalized weights
+		"""
+		positions = np.asarray(positions, dtype=float)
+		weights = np.asarray(weights, dtype=float)
+
+		# weighted mean and weighted (population) covariance, both in [y, x] order
+		self.MEAN = np.dot(weights, positions)
+		centered = positions - self.MEAN
+		self.COVARIANCE = np.dot(centered.T * weights, centered)
+
+		# rms distance of the particles from the mean
+		self.SPREAD = math.sqrt(max(np.trace(self.COVARIANCE), 0.0))
+
+
+	def getMean(self):
+		""" Returns the weighted mean particle location in (y, x) form
+		"""
+		return (self.MEAN[0], self.MEAN[1])
+
+	def getCovariance(self):
+		""" Returns the 2x2 covariance of the particle locations, rows and columns in [y, x] order
+		"""
+		return self.COVARIANCE
+
+	def getSpread(self):
+		""" Returns the standard deviation of the particle locations as an rms distance
+		"""
+		return self.SPREAD
+
+	def getDirectionalStdDev(self, theta):
+		""" Standard deviation of the particle locations along the direction theta, with theta measured as the
+			Sensor measures its beam angles: the beam at theta points along [dy, dx] = [-sin(theta), cos(theta)],
+			since rows grow downwards. That is the standard deviation of x*cos(theta) - y*sin(theta).
+			Derived from the covariance, so it is O(1).
+		"""
+		var_y, cov_yx = self.COVARIANCE[0]
+		var_x = self.COVARIANCE[1][1]
+		c = math.cos(theta)
+		s = math.sin(theta)
+		return math.sqrt(max(s * s * var_y - 2 * c * s * cov_yx + c * c * var_x, 0.0))
@@ -0,0 +1,101 @@
+# Precomputed table of the true sensor ranges at every cell of a map. For a fixed map and sensor configuration
+# these never change, so the table is built once, saved to disk and memory-mapped on later runs.
+import numpy as np
+import os
+import sys
+import hashlib
+from conv_to_bin_mat import ConvBinMap
+
+
+class RangeTable:
+
+	def __init__(self, trueMap, sensor, table_dir="RangeTables"):
+		self.MAP_OBJ = trueMap
+		self.SENSOR = sensor
+		self.MAP_DIMS = trueMap.getDimensions()
+		self.NUM_BEAMS = len(sensor.getSensorAngles())
+		self.TABLE_PATH = os.path.join(table_dir, RangeTable.tableName(trueMap, sensor))
+		self.ROWS_PER_BUILD_CHUNK = 64 # rows of the map cast together while building
+
+		# (rows, cols, beams) float32 array of true distances in meters
+		self.TABLE = None
+
+
+	@staticmethod
+	def tableName(trueMap, sensor):
+		""" Returns the file name of the table for a map and sensor configuration. The table is keyed by
+			floorplan file (its name, a hash of the directory it is in and the hash of its contents, as in
+			ConvBinMap.cache_path), plan scale, sensor max range, aperture and angular resolution, so an edited
+			floorplan or a floorplan of the same name elsewhere never reuses a table.
+		"""
+		floorplan_file = trueMap.getFloorPlanFile()
+		floorplan = os.path.splitext(os.path.basename(floorplan_file))[0]
+		directory_hash = hashlib.sha1(os.path.dirname(os.path.realpath(floorplan_file))).hexdigest()[:8]
+		return "%s.%s.%s_scale%g_range%g_aperture%g_res%g.npy" % (floorplan, directory_hash, ConvBinMap.image_digest(floorplan_file),
+			trueMap.getScale(), sensor.MAX_RANGE, sensor.APERTURE_ANGLE, sensor.ANGULAR_RESOLUTION)
+
+
+	def build(self):
+		""" Casts the rays of every cell of the map and saves the table to TABLE_PATH.
+			Walls are included (they always return 0) so that the table can be indexed by any in-bounds position.
+		"""
+		rows, cols = self.MAP_DIMS
+
+		table = np.empty((rows, cols, self.NUM_BEAMS), dtype=np.float32)
+		col_idx = np.arange(cols)
+		for row in range(0, rows, self.ROWS_PER_BUILD_CHUNK):
+			row_idx = np.arange(row, min(row + self.ROWS_PER_BUILD_CHUNK, rows))
+			positions = np.column_stack((np.repeat(row_idx, cols), np.tile(col_idx, len(row_idx))))
+			table[row_idx] = self.SENSOR.castTrueDistancesBatch(positions).reshape(len(row_idx), cols, self.NUM_BEAMS)
+
+		table_dir = os.path.dirname(self.TABLE_PATH)
+		if table_dir and not os.path.isdir(table_dir):
+			os.makedirs(table_dir)
+
+		# write to a temporary file first so that an interrupted build never leaves a truncated table behind
+		tmp_path = self.TABLE_PATH[:-len(".npy")] + ".tmp.npy"
+		np.save(tmp_path, table)
+		os.rename(tmp_path, self.TABLE_PATH)
+
+
+	def load(self, build_if_missing=True):
+		""" Memory-maps the table from TABLE_PATH, building it first if it does not exist yet.
+			Returns self so that it can be chained into Sensor.useRangeTable
+		"""
+		if not os.path.exists(self.TABLE_PATH):
+			if not build_if_missing:
+				raise IOError("No range table at " + self.TABLE_PATH)
+			print "Building range table", self.TABLE_PATH
+			self.build()
+
+		table = np.load(self.TABLE_PATH, mmap_mode='r')
+		if table.shape != self.MAP_DIMS + (self.NUM_BEAMS,) or table.dtype != np.float32:
+			if not build_if_missing:
+				raise ValueError("Range table " + self.TABLE_PATH + " does not match the map and sensor")
+			print "Rebuilding stale range table", self.TABLE_PATH
+			del table
+			self.build()
+			table = np.load(self.TABLE_PATH, mmap_mode='r')
+		self.TABLE = table
+
+		print "Range table loaded"
+		return self
+
+
+	def lookup(self, positions):
+		""" Takes an (N,2) array of [y, x] positions and returns the (N, beams) np array of true distances,
+			the values Sensor.castTrueDistancesBatch casts (to float32 precision).
+		"""
+		positions = np.asarray(positions, dtype=int).reshape(-1, 2)
+		return self.TABLE[positions[:, 0], positions[:, 1]].astype(float)
+
+
+# Offline build step, e.g. python RangeTable.py BinaryMaps/MD_0_binary.png
+if __name__ == '__main__':
+	from TrueMap import TrueMap
+	from Sensor import Sensor
+
+	the_map = TrueMap(floorplan=sys.argv[1]) if len(sys.argv) > 1 else TrueMap()
+	range_table = RangeTable(the_map, Sensor(the_map))
+	range_table.build()
+	print "Range table saved to", range_table.TABLE_PATH
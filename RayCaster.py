@@ -0,0 +1,320 @@
+# Exact grid traversal (Amanatides & Woo) shared by the Sensor, Odometry and RobotMap. A ray visits every grid cell
+# it passes through exactly once and in order, so it can never step over a thin wall or sample the same pixel twice.
+#
+# Points are continuous [y, x] (row, col) coordinates in pixels, where cell (row, col) covers [row, row+1) x [col, col+1).
+# Rays cast from a cell start at its center.
+import numpy as np
+import math
+
+
+class RayCaster:
+
+	@staticmethod
+	def traverse(start, end):
+		""" Generator of the (row, col) cells on the segment from the point start to the point end, in order,
+			beginning with the cell containing start and ending with the cell containing end.
+		"""
+		y, x = start
+		row, col = int(math.floor(y)), int(math.floor(x))
+		end_row, end_col = int(math.floor(end[0])), int(math.floor(end[1]))
+		dy = end[0] - y
+		dx = end[1] - x
+
+		# t runs from 0 at start to 1 at end. tMax is the t at which the next row/col boundary is crossed
+		# and tDelta is the t it takes to cross a whole cell
+		step_row = 1 if dy > 0 else -1
+		step_col = 1 if dx > 0 else -1
+		tDeltaRow = abs(1.0 / dy) if dy != 0 else float('inf')
+		tDeltaCol = abs(1.0 / dx) if dx != 0 else float('inf')
+		tMaxRow = ((row + 1 - y) if dy > 0 else (y - row)) * tDeltaRow if dy != 0 else float('inf')
+		tMaxCol = ((col + 1 - x) if dx > 0 else (x - col)) * tDeltaCol if dx != 0 else float('inf')
+
+		yield (row, col)
+		for i in range(abs(end_row - row) + abs(end_col - col)):
+			# an axis that has reached the end cell never steps again, whatever the rounding of tMax
+			if row == end_row or (col != end_col and tMaxCol < tMaxRow):
+				col += step_col
+				tMaxCol += tDeltaCol
+			else:
+				row += step_row
+				tMaxRow += tDeltaRow
+			yield (row, col)
+
+
+	@staticmethod
+	def traverseSegments(starts, ends):
+		""" Vectorized traverse over the segments between the points of (S,2) arrays of starts and ends.
+			Returns np arrays (segment, row, col) with one entry per cell visited: each segment's cells in
+			order, segment after segment. These are the cells traverse gives, except that where a segment passes
+			exactly through a cell corner, rounding may decide differently which of the two neighbors it visits.
+
+			A segment crosses |end_row - row| row boundaries and |end_col - col| column boundaries, at evenly
+			spaced t. Sorting all the crossings of all the segments by (segment, t) gives every step at once.
+		"""
+		starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+		ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+		numSegments = len(starts)
+		y, x = starts[:, 0], starts[:, 1]
+		row, col = np.floor(y).astype(int), np.floor(x).astype(int)
+		dy = ends[:, 0] - y
+		dx = ends[:, 1] - x
+		numRowSteps = np.abs(np.floor(ends[:, 0]).astype(int) - row)
+		numColSteps = np.abs(np.floor(ends[:, 1]).astype(int) - col)
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			tDeltaRow = np.abs(1.0 / dy)
+			tDeltaCol = np.abs(1.0 / dx)
+			tMaxRow = np.where(dy > 0, row + 1 - y, y - row) * tDeltaRow
+			tMaxCol = np.where(dx > 0, col + 1 - x, x - col) * tDeltaCol
+
+		# one event per cell: the start cell of each segment (at t = -1) and each boundary crossing
+		segment = np.concatenate((np.arange(numSegments), np.repeat(np.arange(numSegments), numRowSteps),
+								np.repeat(np.arange(numSegments), numColSteps)))
+		rowCrossing = np.arange(numRowSteps.sum()) - np.repeat(np.cumsum(numRowSteps) - numRowSteps, numRowSteps)
+		colCrossing = np.arange(numColSteps.sum()) - np.repeat(np.cumsum(numColSteps) - numColSteps, numColSteps)
+		rowSeg = segment[numSegments:numSegments + len(rowCrossing)]
+		colSeg = segment[numSegments + len(rowCrossing):]
+		t = np.concatenate((np.full(numSegments, -1.0), tMaxRow[rowSeg] + rowCrossing * tDeltaRow[rowSeg],
+							tMaxCol[colSeg] + colCrossing * tDeltaCol[colSeg]))
+		rowStep = np.concatenate((np.zeros(numSegments, dtype=int), np.where(dy > 0, 1, -1)[rowSeg], np.zeros(len(colSeg), dtype=int)))
+		colStep = np.concatenate((np.zeros(numSegments + len(rowSeg), dtype=int), np.where(dx > 0, 1, -1)[colSeg]))
+		# like traverse, a row crossing comes first when it is at the same t as a column crossing
+		isCol = np.concatenate((np.zeros(numSegments + len(rowSeg), dtype=int), np.ones(len(colSeg), dtype=int)))
+
+		order = np.lexsort((isCol, t, segment))
+		segment, rowStep, colStep = segment[order], rowStep[order], colStep[order]
+
+		# each cell is the start cell plus the steps taken so far along its segment
+		firstEvent = np.searchsorted(segment, segment)
+		rowSteps = np.cumsum(rowStep)
+		colSteps = np.cumsum(colStep)
+		rows = row[segment] + rowSteps - rowSteps[firstEvent]
+		cols = col[segment] + colSteps - colSteps[firstEvent]
+		return segment, rows, cols
+
+
+	@staticmethod
+	def castRay(grid, origin, direction, max_t):
+		""" Casts a ray from the center of the cell origin = [row, col] along direction = [dy, dx] (a unit vector)
+			and returns the distance (in cells) at which it enters the first occupied (1) cell of grid.
+			Returns max_t if no wall is found within max_t or the ray leaves the grid.
+			An origin inside a wall returns 0.
+		"""
+		map_rows, map_cols = grid.shape
+		row, col = int(origin[0]), int(origin[1])
+		if grid[row, col] == 1:
+			return 0.0
+
+		dy, dx = direction
+		step_row = 1 if dy > 0 else -1
+		step_col = 1 if dx > 0 else -1
+		tDeltaRow = abs(1.0 / dy) if dy != 0 else float('inf')
+		tDeltaCol = abs(1.0 / dx) if dx != 0 else float('inf')
+		# starting from the center, the k-th boundary of an axis is crossed at t = (k + 0.5) * tDelta. The t are
+		# computed from k rather than accumulated, so that castRayPyramid, which skips boundaries, gets the very
+		# same t and decides rays through cell corners (equal t on both axes) the same way
+		rowCrossings = colCrossings = 0
+
+		while True:
+			tMaxRow = (rowCrossings + 0.5) * tDeltaRow
+			tMaxCol = (colCrossings + 0.5) * tDeltaCol
+			if tMaxCol < tMaxRow:
+				t = tMaxCol
+				col += step_col
+				colCrossings += 1
+			else:
+				t = tMaxRow
+				row += step_row
+				rowCrossings += 1
+
+			if t >= max_t or row < 0 or row >= map_rows or col < 0 or col >= map_cols:
+				return max_t
+			if grid[row, col] == 1:
+				return t
+
+
+	@staticmethod
+	def castRays(grid, origins, directions, max_t):
+		""" Vectorized castRay. Casts every direction of an (A,2) array from every cell of an (N,2) array of
+			origins and returns an (N, A) np array of distances (in cells). All rays advance one cell per
+			iteration, and only rays that have not yet finished are carried along.
+		"""
+		origins = np.asarray(origins, dtype=int).reshape(-1, 2)
+		directions = np.asarray(directions, dtype=float).reshape(-1, 2)
+		map_rows, map_cols = grid.shape
+		numOrigins, numDirections = len(origins), len(directions)
+
+		distances = np.full(numOrigins * numDirections, float(max_t))
+
+		# one entry per ray, laid out origin-major so that the result reshapes to (N, A)
+		row = np.repeat(origins[:, 0], numDirections)
+		col = np.repeat(origins[:, 1], numDirections)
+		dy = np.tile(directions[:, 0], numOrigins)
+		dx = np.tile(directions[:, 1], numOrigins)
+
+		with np.errstate(divide='ignore'):
+			tDeltaRow = np.abs(1.0 / dy)
+			tDeltaCol = np.abs(1.0 / dx)
+		step_row = np.where(dy > 0, 1, -1)
+		step_col = np.where(dx > 0, 1, -1)
+		rowCrossings = np.zeros(numOrigins * numDirections, dtype=int)
+		colCrossings = np.zeros(numOrigins * numDirections, dtype=int)
+
+		# rays starting inside a wall return 0
+		done = grid[row, col] == 1
+		distances[done] = 0.0
+		ray = np.arange(numOrigins * numDirections)  # indices of the rays still being traversed
+
+		while True:
+			keep = ~done
+			ray, row, col = ray[keep], row[keep], col[keep]
+			step_row, step_col = step_row[keep], step_col[keep]
+			rowCrossings, colCrossings = rowCrossings[keep], colCrossings[keep]
+			tDeltaRow, tDeltaCol = tDeltaRow[keep], tDeltaCol[keep]
+			if not len(ray):
+				break
+
+			tMaxRow = (rowCrossings + 0.5) * tDeltaRow
+			tMaxCol = (colCrossings + 0.5) * tDeltaCol
+			stepCol = tMaxCol < tMaxRow
+			t = np.where(stepCol, tMaxCol, tMaxRow)
+			col = col + np.where(stepCol, step_col, 0)
+			row = row + np.where(stepCol, 0, step_row)
+			colCrossings = colCrossings + stepCol
+			rowCrossings = rowCrossings + ~stepCol
+
+			outOfRange = (t >= max_t) | (row < 0) | (row >= map_rows) | (col < 0) | (col >= map_cols)
+			hit = np.zeros(len(ray), dtype=bool)
+			hit[~outOfRange] = grid[row[~outOfRange], col[~outOfRange]] == 1
+			distances[ray[hit]] = t[hit]
+			done = hit | outOfRange
+
+		return distances.reshape(numOrigins, numDirections)
+
+
+	@staticmethod
+	def crossingsBefore(t, tDelta, inclusive):
+		""" Returns the number of boundaries k = 0, 1, ... of an axis, crossed at (k + 0.5) * tDelta as in castRay,
+			that a ray has crossed before t (or at t, if inclusive). Works on scalars and on np arrays.
+		"""
+		# the estimate is off by at most one, which comparing with castRay's own t settles exactly
+		crossed = (lambda k: (k + 0.5) * tDelta <= t) if inclusive else (lambda k: (k + 0.5) * tDelta < t)
+		if np.isscalar(t):
+			count = max(int(math.floor(t / tDelta + 0.5)), 0)
+			if count > 0 and not crossed(count - 1):
+				return count - 1
+			return count + 1 if crossed(count) else count
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			count = np.maximum(np.floor(np.divide(t, tDelta) + 0.5), 0)
+		count = np.where((count > 0) & ~crossed(count - 1), count - 1, count)
+		count = np.where(crossed(count), count + 1, count)
+		return count.astype(int)
+
+
+	@staticmethod
+	def castRayPyramid(pyramid, origin, direction, max_t):
+		""" castRay with empty-space skipping over an OccupancyPyramid of the grid. From each free cell the ray
+			jumps straight to the exit of the largest free block containing it, so it only walks cell by cell
+			near walls. The t of each boundary is computed as castRay computes it, so the distances are exactly
+			castRay's, including for rays through cell corners.
+		"""
+		grid = pyramid.getLevel(0)
+		map_rows, map_cols = grid.shape
+		row0, col0 = int(origin[0]), int(origin[1])
+		if grid[row0, col0] == 1:
+			return 0.0
+
+		row, col = row0, col0
+		dy, dx = direction
+		step_row = 1 if dy > 0 else -1
+		step_col = 1 if dx > 0 else -1
+		tDeltaRow = abs(1.0 / dy) if dy != 0 else float('inf')
+		tDeltaCol = abs(1.0 / dx) if dx != 0 else float('inf')
+		while True:
+			level = pyramid.emptyLevel(row, col)
+			size = 1 << level
+			block_row = (row >> level) << level
+			block_col = (col >> level) << level
+
+			# the cells just past the block's top or bottom, and left or right side, and the t at which the ray
+			# crosses into them: the crossing of the boundaries between the origin and them
+			exit_row = block_row + size if dy > 0 else block_row - 1
+			exit_col = block_col + size if dx > 0 else block_col - 1
+			tRow = (abs(exit_row - row0) - 0.5) * tDeltaRow
+			tCol = (abs(exit_col - col0) - 0.5) * tDeltaCol
+
+			# like castRay, a row crossing at the same t as a column crossing comes first
+			if tCol < tRow:
+				t = tCol
+				col = exit_col
+				row = row0 + step_row * RayCaster.crossingsBefore(t, tDeltaRow, True)
+			else:
+				t = tRow
+				row = exit_row
+				col = col0 + step_col * RayCaster.crossingsBefore(t, tDeltaCol, False)
+
+			if t >= max_t or row < 0 or row >= map_rows or col < 0 or col >= map_cols:
+				return max_t
+			if grid[row, col] == 1:
+				return t
+
+
+	@staticmethod
+	def castRaysPyramid(pyramid, origins, directions, max_t):
+		""" Vectorized castRayPyramid, with the same (N, A) result as castRays.
+		"""
+		grid = pyramid.getLevel(0)
+		origins = np.asarray(origins, dtype=int).reshape(-1, 2)
+		directions = np.asarray(directions, dtype=float).reshape(-1, 2)
+		map_rows, map_cols = grid.shape
+		numOrigins, numDirections = len(origins), len(directions)
+
+		distances = np.full(numOrigins * numDirections, float(max_t))
+
+		row0 = np.repeat(origins[:, 0], numDirections)
+		col0 = np.repeat(origins[:, 1], numDirections)
+		row, col = row0, col0
+		dy = np.tile(directions[:, 0], numOrigins)
+		dx = np.tile(directions[:, 1], numOrigins)
+		with np.errstate(divide='ignore'):
+			tDeltaRow = np.abs(1.0 / dy)
+			tDeltaCol = np.abs(1.0 / dx)
+		step_row = np.where(dy > 0, 1, -1)
+		step_col = np.where(dx > 0, 1, -1)
+
+		done = grid[row, col] == 1
+		distances[done] = 0.0
+		ray = np.arange(numOrigins * numDirections)
+
+		while True:
+			keep = ~done
+			ray, row, col, row0, col0 = ray[keep], row[keep], col[keep], row0[keep], col0[keep]
+			step_row, step_col, tDeltaRow, tDeltaCol = step_row[keep], step_col[keep], tDeltaRow[keep], tDeltaCol[keep]
+			if not len(ray):
+				break
+
+			level = pyramid.emptyLevels(row, col)
+			size = 1 << level
+			block_row = (row >> level) << level
+			block_col = (col >> level) << level
+
+			exit_row = np.where(step_row > 0, block_row + size, block_row - 1)
+			exit_col = np.where(step_col > 0, block_col + size, block_col - 1)
+			tRow = (np.abs(exit_row - row0) - 0.5) * tDeltaRow
+			tCol = (np.abs(exit_col - col0) - 0.5) * tDeltaCol
+
+			stepCol = tCol < tRow
+			t = np.where(stepCol, tCol, tRow)
+			crossedRow = row0 + step_row * RayCaster.crossingsBefore(t, tDeltaRow, True)
+			crossedCol = col0 + step_col * RayCaster.crossingsBefore(t, tDeltaCol, False)
+			row = np.where(stepCol, crossedRow, exit_row)
+			col = np.where(stepCol, exit_col, crossedCol)
+
+			outOfRange = (t >= max_t) | (row < 0) | (row >= map_rows) | (col < 0) | (col >= map_cols)
+			hit = np.zeros(len(ray), dtype=bool)
+			hit[~outOfRange] = grid[row[~outOfRange], col[~outOfRange]] == 1
+			distances[ray[hit]] = t[hit]
+			done = hit | outOfRange
+
+		return distances.reshape(numOrigins, numDirections)
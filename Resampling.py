@@ -0,0 +1,119 @@
+# Resampling strategies for the particle filter. Each takes an (N,) array of normalized weights and the number
+# of particles to draw, and returns an array of the indices of the chosen particles (sorted, so that copies of a
+# particle are adjacent). The caller gathers the particles with a single fancy-indexing copy.
+import numpy as np
+from scipy import stats
+
+
+class Resampler:
+
+	METHODS = ('systematic', 'stratified', 'residual', 'multinomial')
+
+	@staticmethod
+	def getMethod(name):
+		""" Returns the resampling function with the given name (one of Resampler.METHODS)
+		"""
+		if name not in Resampler.METHODS:
+			raise ValueError("Unknown resampling method: " + str(name))
+		return getattr(Resampler, name)
+
+
+	@staticmethod
+	def cumulativeWeights(weights):
+		""" Cumulative sum of the weights with the last entry forced to exactly 1, so that
+			rounding can never leave a draw past the end of the array
+		"""
+		cumulative = np.cumsum(weights)
+		cumulative /= cumulative[-1]
+		cumulative[-1] = 1.0
+		return cumulative
+
+
+	@staticmethod
+	def systematic(weights, numSamples):
+		""" Low-variance resampling: one uniform draw u, and samples at (u + k)/numSamples.
+			The number of samples falling in each particle's interval of the cumulative weights
+			is counted directly, so the whole thing is O(N).
+		"""
+		cumulative = Resampler.cumulativeWeights(weights)
+		u = np.random.random()
+
+		# number of samples (u + k)/numSamples below each cumulative weight
+		below = np.ceil(numSamples * cumulative - u).astype(int)
+		np.clip(below, 0, numSamples, out=below)
+		counts = np.diff(np.concatenate(([0], below)))
+
+		return np.repeat(np.arange(len(weights)), counts)
+
+
+	@staticmethod
+	def stratified(weights, numSamples):
+		""" One independent uniform sample in each of numSamples equal strata of [0, 1).
+			The samples are sorted by construction, which keeps the search cheap.
+		"""
+		cumulative = Resampler.cumulativeWeights(weights)
+		positions = (np.arange(numSamples) + np.random.random(numSamples)) / numSamples
+		return np.searchsorted(cumulative, positions, side='right')
+
+
+	@staticmethod
+	def residual(weights, numSamples):
+		""" Deterministically keeps floor(numSamples * w) copies of each particle and draws
+			the remaining samples multinomially from the leftover weight.
+		"""
+		expected = numSamples * np.asarray(weights, dtype=float) / np.sum(weights)
+		counts = np.floor(expected).astype(int)
+		numResidual = numSamples - np.sum(counts)
+
+		if numResidual > 0:
+			residualWeights = expected - counts
+			counts += np.bincount(Resampler.multinomial(residualWeights, numResidual), minlength=len(weights))
+
+		return np.repeat(np.arange(len(weights)), counts)
+
+
+	@staticmethod
+	def multinomial(weights, numSamples):
+		""" Independent draws with replacement, the same distribution as np.random.choice.
+			The uniform draws are generated already sorted (normalized sums of exponential spacings)
+			instead of being drawn and then sorted.
+		"""
+		cumulative = Resampler.cumulativeWeights(weights)
+		spacings = np.random.exponential(size=numSamples + 1)
+		positions = np.cumsum(spacings[:-1]) / np.sum(spacings)
+		return np.searchsorted(cumulative, positions, side='right')
+
+
+	@staticmethod
+	def kldBound(numBins, epsilon, delta):
+		""" KLD-sampling bound (Fox, 2003): the number of samples needed so that, with probability 1 - delta,
+			the KL divergence between the sample-based and the true posterior is below epsilon, when the
+			samples occupy numBins histogram bins. Works elementwise on an array of bin counts.
+		"""
+		k = np.maximum(np.asarray(numBins, dtype=float) - 1, 1)
+		z = stats.norm.ppf(1 - delta)
+		a = 2.0 / (9.0 * k)
+		return k / (2.0 * epsilon) * np.power(1 - a + np.sqrt(a) * z, 3)
+
+
+	@staticmethod
+	def kldResample(resample, weights, binIds, epsilon, delta, minSamples, maxSamples):
+		""" Adaptive resampling. Draws maxSamples indices with the resample function, puts them in random
+			order and keeps the shortest prefix that satisfies the KLD bound for the number of histogram bins
+			(given by the (N,) array binIds of each particle's bin) it occupies, and has at least minSamples.
+
+			The whole draw is evaluated at once: the bins occupied after each sample are a cumulative count
+			of first occurrences.
+		"""
+		indices = np.random.permutation(resample(weights, maxSamples))
+
+		# mark the first sample to land in each bin, the running count is the number of occupied bins
+		firstInBin = np.zeros(maxSamples, dtype=bool)
+		firstInBin[np.unique(binIds[indices], return_index=True)[1]] = True
+		occupiedBins = np.cumsum(firstInBin)
+
+		numSamples = np.arange(1, maxSamples + 1)
+		enough = (numSamples >= Resampler.kldBound(occupiedBins, epsilon, delta)) & (numSamples >= minSamples)
+		count = np.argmax(enough) + 1 if np.any(enough) else maxSamples
+
+		return np.sort(indices[:count])
@@ -2,6 +2,7 @@ from Odometry import Odometry
 from ParticleFilter import ParticleFilter
 from Sensor import Sensor
 from TrueMap import TrueMap
+from RangeTable import RangeTable
 from visualization import Visualization
 import time
 
@@ -19,6 +20,7 @@ if __name__ == '__main__':
 	# the_map = TrueMap()
 	viz = Visualization(the_map, start_x=initx, start_y=inity)
 	sensor = Sensor(the_map)
+	sensor.useRangeTable(RangeTable(the_map, sensor).load())  # true ranges are looked up instead of cast
 	odom = Odometry(the_map, start_x=initx, start_y=inity)
 	part_filt = ParticleFilter(the_map, sensor, odom, numParticles=100)
 	part_filt.initializeParticles()
@@ -1,44 +1,118 @@
 import numpy as np
 import math
+import copy
+import json
+import os
+from RayCaster import RayCaster
+from ChunkedGrid import ChunkedGrid
+from MapLog import MapLog
 
 class RobotMap:
 
-	def __init__(self, particleFilter, posteriorProb=0.5, start_x=170, start_y=150, dimensions=(270,240), plan_scale=.04805, sensor_noise = .5):
-		# Dimension is of form (#rows, #umns)
-		self.LEARNING_RATE = .5 # weight to give new scan relative to old belief
-		self.MAP = np.full(dimensions, posteriorProb)
+	def __init__(self, particleFilter, posteriorProb=0.5, start_x=170, start_y=150, dimensions=None, plan_scale=.04805, sensor_noise = .5,
+				hitProb=.7, missProb=.4, logOddsResolution=.01, maxLogOdds=6.9, dtype=np.int16, chunkSize=64):
+		# The map is kept in log-odds, log(p / (1 - p)) of each pixel being a wall, so that evidence from each scan
+		# simply adds up. It is stored in fixed point as integer multiples of logOddsResolution, clamped to
+		# +-maxLogOdds so that no pixel becomes too certain to be revised. Probabilities are only computed on reads
+		self.LOG_ODDS_RESOLUTION = logOddsResolution
+		self.LOG_ODDS_LIMIT = min(int(round(maxLogOdds / logOddsResolution)), np.iinfo(dtype).max)
+		self.PRIOR_LOG_ODDS = self.toLogOdds(posteriorProb)
+		# the map has no fixed size: it is stored in chunkSize x chunkSize blocks allocated as the robot first sees
+		# them (see ChunkedGrid), in the pixel coordinates of the particles, and may grow in any direction
+		self.LOG_ODDS = ChunkedGrid(fill=self.PRIOR_LOG_ODDS, dtype=dtype, chunkSize=chunkSize)
+		# Dimension is of form (#rows, #columns), the region getMap returns by default. None for all the map seen so far
+		self.DIMENSIONS = dimensions
+		self.HIT_PROB = hitProb # probability of a wall at a beam's endpoint, given by the inverse sensor model
+		self.MISS_PROB = missProb # and of a wall on the way to the endpoint
 		self.SENSOR_NOISE = sensor_noise
 		self.PLAN_SCALE = plan_scale
 		self.part_filt = particleFilter
-		self.X_MAX = dimensions[1]
-		self.Y_MAX = dimensions[0]
 		self.SENSOR_RANGE = 8;
 
-	def updateMap(self, scanAngles, scanRanges):
-		supposedPosition = self.part_filt.getSupposedLocation()
-		# Step 1: combine sigma due to sensor noise and sigma due to location uncertainty
-		for i in range(len(scanAngles)):
-			if scanRanges[i] < (self.SENSOR_RANGE - .1):
-				# Find combined sigma of scanner and directional position uncertainty
-				# print "Scan Angle: " , scanAngles[i]
-				sigmaTotal = math.sqrt(np.square(self.SENSOR_NOISE) + np.square(self.part_filt.getParticleStdDevDirectional(scanAngles[i])))
-				
-				# Determine which pixels should be updated
-				# print "Scan location second part: ", (scanRanges[i]/self.PLAN_SCALE) * math.sin(scanAngles[i])
-				scanYLocation = supposedPosition[0] - (scanRanges[i]/self.PLAN_SCALE) * math.sin(scanAngles[i]) 
-				scanXLocation = supposedPosition[1] + (scanRanges[i]/self.PLAN_SCALE) * math.cos(scanAngles[i])
-
-				pixelsToUpdate = self.getPixelsOnLine((scanYLocation, scanXLocation), 8 * sigmaTotal, scanAngles[i])
-				
-				for pixel in pixelsToUpdate:
-					if pixel[0] >= 0 and pixel[0] < self.Y_MAX and pixel[1] >= 0 and pixel[1] < self.X_MAX:
-						oldProb = self.MAP[pixel[0]][pixel[1]]
-						pixelRange = math.sqrt(np.square((supposedPosition[0] - pixel[0])) + np.square((supposedPosition[1] - pixel[1])))
-						newProb = self.gaussian(scanRanges[i], sigmaTotal, pixelRange)
-						self.MAP[pixel[0]][pixel[1]] = self.LEARNING_RATE * newProb + (1-self.LEARNING_RATE) * oldProb
-
-		#print self.MAP
-		return self.MAP
+	def toLogOdds(self, prob):
+		""" Converts a probability (or np array of them) to clamped fixed point log-odds
+		"""
+		with np.errstate(divide='ignore'):
+			logOdds = np.rint(np.log(prob / (1.0 - np.asarray(prob, dtype=float))) / self.LOG_ODDS_RESOLUTION)
+		return np.clip(logOdds, -self.LOG_ODDS_LIMIT, self.LOG_ODDS_LIMIT).astype(int)
+
+	def logOddsToProbability(self, logOdds):
+		""" Converts fixed point log-odds (e.g. getLogOdds) to the probability of a wall, as float32
+		"""
+		return (1.0 / (1.0 + np.exp(-np.asarray(logOdds, dtype=np.float32) * self.LOG_ODDS_RESOLUTION))).astype(np.float32)
+
+	def updateMap(self, scanAngles, scanRanges, pose=None):
+		""" Adds the scan's evidence to the map. Each beam is walked from the robot to just past its endpoint,
+			visiting each pixel once: the pixels it crossed are evidence of free space and the pixels around its
+			endpoint evidence of a wall. Max-range beams hit nothing, so they only carve free space.
+			All beams are handled at once and the evidence is added with one scatter.
+
+			The scan is placed at the particles' mean, with their spread added to the sensor noise, unless a
+			pose = [y, x] is given, which is taken as exact.
+		"""
+		angles = np.asarray(scanAngles, dtype=float)
+		ranges = np.asarray(scanRanges, dtype=float)
+		if not len(ranges):
+			return
+
+		# Step 1: combine sigma due to sensor noise and sigma due to location uncertainty (in the beam's direction),
+		# both in meters
+		if pose is None:
+			# particle statistics are computed once per filter update and shared by all beams
+			poseStats = self.part_filt.getPoseStatistics()
+			supposedPosition = np.asarray(poseStats.getMean())
+			directionalStdDevs = np.array([poseStats.getDirectionalStdDev(angle) for angle in angles]) * self.PLAN_SCALE
+		else:
+			supposedPosition = np.asarray(pose, dtype=float)
+			directionalStdDevs = np.zeros(len(angles))
+		sigmaTotal = np.sqrt(np.square(self.SENSOR_NOISE) + np.square(directionalStdDevs))
+
+		pose, rows, cols, logOdds = self.scanEvidence(angles, ranges, supposedPosition[None], sigmaTotal[None])
+		self.addLogOdds(rows, cols, logOdds)
+
+
+	def scanEvidence(self, angles, ranges, positions, sigmaTotal):
+		""" Evidence of a scan taken from each of P poses: positions is a (P,2) array of [y, x] and sigmaTotal a
+			(P, beams) array of the combined sigma of each beam in meters. Returns np arrays (pose, row, col, logOdds)
+			with one entry per pixel per beam, grouped by pose.
+		"""
+		numBeams = len(angles)
+		maxRange = ranges >= (self.SENSOR_RANGE - .1)
+
+		# Step 2: the pixels to update lie on each beam, from the robot to 4 sigma past the endpoint (or to the
+		# sensor's range for max-range beams)
+		rowPerMeter = -np.sin(angles) / self.PLAN_SCALE
+		colPerMeter = np.cos(angles) / self.PLAN_SCALE
+		reach = np.where(maxRange, self.SENSOR_RANGE, ranges + 4 * sigmaTotal)
+		# the .5 offsets round the beam's coordinates to the nearest pixel
+		starts = np.repeat(positions + .5, numBeams, axis=0)
+		ends = np.column_stack(((positions[:, 0, None] + reach * rowPerMeter + .5).ravel(), (positions[:, 1, None] + reach * colPerMeter + .5).ravel()))
+		segment, rows, cols = RayCaster.traverseSegments(starts, ends)
+		pose, beam = np.divmod(segment, numBeams)
+
+		# Step 3: inverse sensor model. Around the endpoint the probability of a wall peaks at HIT_PROB with a
+		# Gaussian profile. Before it, the profile blends into MISS_PROB (free space); past it, into no information (.5)
+		pixelRanges = np.hypot(positions[pose, 0] - rows, positions[pose, 1] - cols) * self.PLAN_SCALE
+		sigmas = sigmaTotal.ravel()[segment]
+		profile = self.gaussian(ranges[beam], sigmas, pixelRanges) * np.sqrt(2.0 * math.pi) * sigmas
+		profile[maxRange[beam]] = 0.0
+		wallProbs = np.where(pixelRanges < ranges[beam], self.MISS_PROB, .5) * (1 - profile) + self.HIT_PROB * profile
+		return pose, rows, cols, self.toLogOdds(wallProbs)
+
+
+	def addLogOdds(self, rows, cols, logOdds):
+		""" Adds fixed point log-odds evidence to the pixels at np arrays of rows and cols (repeats add up),
+			clamping the result
+		"""
+		if not len(rows):
+			return
+		# combine the evidence for each pixel first; pixels are keyed by their offset from the first one
+		top, left = rows.min(), cols.min()
+		width = cols.max() - left + 1
+		pixels, pixelIds = np.unique((rows - top) * width + (cols - left), return_inverse=True)
+		evidence = np.bincount(pixelIds, weights=logOdds).astype(int)
+		pixelRows, pixelCols = np.divmod(pixels, width)
+		self.LOG_ODDS.addClipped(pixelRows + top, pixelCols + left, evidence, -self.LOG_ODDS_LIMIT, self.LOG_ODDS_LIMIT)
 
 
 	def gaussian(self, mu, sigma, x):
@@ -52,7 +126,8 @@ class RobotMap:
 		# print "sigma", sigma
 		# print "x", x
 		# calculates the probability of x for 1-dim Gaussian with mean mu and var. sigma
-		return math.exp(- ((mu - x) ** 2) / (sigma ** 2) / 2.0) / math.sqrt(2.0 * math.pi * (sigma ** 2))
+		# also works elementwise on np arrays
+		return np.exp(- ((mu - x) ** 2) / (sigma ** 2) / 2.0) / np.sqrt(2.0 * math.pi * (sigma ** 2))
 
 
 	# Returns a set of pixel values that lie along a specified line
@@ -60,17 +135,89 @@ class RobotMap:
 		"""
 		CURRENTLY UNTESTED!!!!!
 		"""
-		distancesAlongLine = np.linspace(-length/2, length/2, length/self.PLAN_SCALE)
-		pixels = set()
-		for distance in distancesAlongLine:
-			y = int(center[0] - distance * math.sin(angle) + .5)
-			x = int(center[1] + distance * math.cos(angle) + .5)
-			pixels.add((y,x))
-		return pixels
+		# walk the grid from one end of the line to the other, visiting each pixel once.
+		# the .5 offsets round the line's coordinates to the nearest pixel
+		start = (center[0] + (length/2) * math.sin(angle) + .5, center[1] - (length/2) * math.cos(angle) + .5)
+		end = (center[0] - (length/2) * math.sin(angle) + .5, center[1] + (length/2) * math.cos(angle) + .5)
+		return set(RayCaster.traverse(start, end))
+
+	def copy(self):
+		""" Returns a copy of the map that shares its storage until one of them is updated (see ChunkedGrid.copy)
+		"""
+		robotMap = copy.copy(self)
+		robotMap.LOG_ODDS = self.LOG_ODDS.copy()
+		return robotMap
+
+	def release(self):
+		""" Frees the map's storage (see ChunkedGrid.release). The map reads as the prior afterwards.
+		"""
+		self.LOG_ODDS.release()
+
+	def getVersion(self):
+		""" Returns the map's version, which every update increments (see getDirtyRegions)
+		"""
+		return self.LOG_ODDS.getVersion()
+
+	def getDirtyRegions(self, since=0):
+		""" Returns the list of regions (row_min, row_max, col_min, col_max) changed by the updates after version
+			since, one per changed chunk. A consumer keeps the getVersion() of its last read and only re-reads these.
+		"""
+		return [self.LOG_ODDS.getChunkRegion(*key) for key in self.LOG_ODDS.getModifiedChunks(since)]
 
-	def getMap(self):
-		return self.MAP
+	def getLogMetadata(self):
+		""" The settings a map log must have been written with to be resumed by this map
+		"""
+		return {'log_odds_resolution': self.LOG_ODDS_RESOLUTION, 'log_odds_limit': self.LOG_ODDS_LIMIT, 'plan_scale': self.PLAN_SCALE}
 
-			
+	def createLog(self, path):
+		""" Starts a new MapLog of this map at path. saveDelta then appends the changes since the previous save.
+		"""
+		if os.path.exists(path):
+			os.remove(path)
+		return MapLog(path, self.LOG_ODDS, self.getLogMetadata())
 
+	def resumeFromLog(self, path):
+		""" Replaces the map with the one saved in the MapLog at path, and returns the log to keep saving to
+		"""
+		grid, metadata = MapLog.replay(path)
+		if metadata != json.loads(json.dumps(self.getLogMetadata())) or grid.FILL != self.PRIOR_LOG_ODDS:
+			raise ValueError("Map log " + path + " was written by a map with different settings")
+		self.LOG_ODDS.release()
+		self.LOG_ODDS = grid
+		return MapLog(path, grid)
+
+	def saveDelta(self, mapLog):
+		""" Appends the chunks changed since the last save to mapLog, and returns how many were written
+		"""
+		return mapLog.append(self.LOG_ODDS)
 
+	def getDefaultRegion(self):
+		""" The region (row_min, row_max, col_min, col_max) the getters return when none is given:
+			the map's dimensions if it was given any, else everything seen so far
+		"""
+		if self.DIMENSIONS is not None:
+			return (0, self.DIMENSIONS[0], 0, self.DIMENSIONS[1])
+		return self.getExtent()
+
+	def getExtent(self):
+		""" Returns (row_min, row_max, col_min, col_max), max exclusive, of the part of the map seen so far,
+			rounded out to whole chunks
+		"""
+		return self.LOG_ODDS.getExtent()
+
+	def getMap(self, region=None):
+		""" Returns the map, or the region = (row_min, row_max, col_min, col_max) of it, as a dense float32
+			np array of the probability of a wall at each pixel
+		"""
+		return self.logOddsToProbability(self.getLogOdds(region))
+
+	def getLogOdds(self, region=None):
+		""" Returns the map, or a region of it, as a dense np array of fixed point log-odds (see LOG_ODDS_RESOLUTION)
+		"""
+		return self.LOG_ODDS.getRegion(region if region is not None else self.getDefaultRegion())
+
+	def getDisplayMatrix(self, region=None):
+		""" Returns the map, or a region of it, for Visualization.display_a_matrix, which draws 0 as a wall and
+			1 as empty space
+		"""
+		return 1 - self.getMap(region)
@@ -0,0 +1,147 @@
+# Correlative scan matcher. Before a scan is added to the robot map, the pose estimate is refined by searching a
+# window of translations around it for the most likely pose given both the scan and the estimate: the scan's
+# endpoints are scored against the map built so far, blurred by the sensor noise (as in a likelihood field), and
+# each translation pays a Gaussian prior cost for moving away from the estimate. The estimate is kept unless another
+# pose beats it by a margin.
+#
+# The search is a branch and bound over the window: precomputed tables give, for each block of 2**k x 2**k
+# translations, an upper bound of the score of every translation in the block, so whole blocks are discarded without
+# scoring their translations one by one.
+import numpy as np
+from scipy import ndimage
+
+
+class ScanMatcher:
+
+	def __init__(self, robotMap, searchRadius=10, numLevels=4, z_hit=.9, z_rand=.1, minPriorSigma=1.0, margin=.5):
+		""" Matches scans against robotMap (a RobotMap). Translations of up to searchRadius pixels along each axis
+			are searched, with blocks of up to 2**(numLevels-1) translations bounded at once.
+
+			An endpoint landing where the blurred map gives a wall probability p scores log(z_hit * p + z_rand).
+			The prior on the translation is an isotropic Gaussian with the particles' standard deviation per
+			axis, at least minPriorSigma pixels. A pose replaces the estimate only if its score (a log
+			likelihood) is higher by more than margin.
+		"""
+		self.ROBOT_MAP = robotMap
+		self.SEARCH_RADIUS = searchRadius
+		self.NUM_LEVELS = numLevels
+		self.PLAN_SCALE = robotMap.PLAN_SCALE
+		self.SENSOR_RANGE = robotMap.SENSOR_RANGE
+		self.BLUR_SIGMA = robotMap.SENSOR_NOISE / robotMap.PLAN_SCALE  # sensor noise, in pixels
+		self.Z_HIT = z_hit
+		self.Z_RAND = z_rand
+		self.MIN_PRIOR_SIGMA = minPriorSigma
+		self.MARGIN = margin
+		self.STATS = {'nodes': 0, 'shift': (0, 0)}  # scored blocks and translation found by the last match
+
+
+	@staticmethod
+	def boundTables(table, numLevels):
+		""" Returns the list of lookup tables, level k holding at [y, x] the maximum of table over
+			[y, y + 2**k) x [x, x + 2**k). Each level is the max of four shifted copies of the one below.
+		"""
+		tables = [table]
+		for level in range(1, numLevels):
+			below = tables[-1]
+			half = 1 << (level - 1)
+			shifted = np.full((below.shape[0] + half, below.shape[1] + half), -np.inf, dtype=below.dtype)
+			shifted[:below.shape[0], :below.shape[1]] = below
+			tables.append(np.maximum(np.maximum(below, shifted[half:, :below.shape[1]]),
+								np.maximum(shifted[:below.shape[0], half:], shifted[half:, half:])))
+		return tables
+
+
+	def endpointTable(self, region):
+		""" Returns the log(z_hit * p + z_rand) score of an endpoint landing on each pixel of region, where p is
+			the robot map's wall probability blurred by the sensor noise
+		"""
+		row_min, row_max, col_min, col_max = region
+		# the blur reaches 3 sigma into the map around the region
+		pad = int(np.ceil(3 * self.BLUR_SIGMA))
+		probs = self.ROBOT_MAP.getMap((row_min - pad, row_max + pad, col_min - pad, col_max + pad))
+		blurred = ndimage.gaussian_filter(probs, self.BLUR_SIGMA, mode='nearest')[pad:pad + row_max - row_min, pad:pad + col_max - col_min]
+		return np.log(self.Z_HIT * blurred + self.Z_RAND).astype(np.float32)
+
+
+	def match(self, scanAngles, scanRanges, estimate, spread=0.0):
+		""" Returns the [y, x] pose within the search window around estimate = (y, x) with the highest score:
+			the log likelihood of the scan's endpoints in the blurred robot map plus the log prior of the
+			translation, for particles with an rms spread (see PoseStatistics.getSpread) in pixels. The
+			estimate itself is kept unless another pose scores more than MARGIN higher, so a map with nothing
+			to match against leaves it unchanged.
+		"""
+		angles = np.asarray(scanAngles, dtype=float)
+		ranges = np.asarray(scanRanges, dtype=float)
+		# max-range beams have no endpoint to match
+		inRange = ranges < (self.SENSOR_RANGE - .1)
+		estimate = np.rint(np.asarray(estimate, dtype=float)).astype(int)
+		self.STATS = {'nodes': 0, 'shift': (0, 0)}
+		if not np.any(inRange):
+			return estimate
+
+		# endpoint of each beam relative to the pose, in pixels
+		endRows = np.rint(-ranges[inRange] * np.sin(angles[inRange]) / self.PLAN_SCALE).astype(int)
+		endCols = np.rint(ranges[inRange] * np.cos(angles[inRange]) / self.PLAN_SCALE).astype(int)
+
+		# the part of the map any endpoint of any translation (and block of them) can land in
+		radius = self.SEARCH_RADIUS
+		blockSize = 1 << (self.NUM_LEVELS - 1)
+		top = estimate[0] - radius + endRows.min()
+		left = estimate[1] - radius + endCols.min()
+		region = (top, estimate[0] + radius + blockSize + endRows.max(), left, estimate[1] + radius + blockSize + endCols.max())
+		tables = self.boundTables(self.endpointTable(region), self.NUM_LEVELS)
+
+		# table index of each endpoint at the smallest translation (-radius, -radius)
+		baseRows = endRows + estimate[0] - radius - top
+		baseCols = endCols + estimate[1] - radius - left
+
+		# Gaussian prior of the translation, with the particles' standard deviation along each axis
+		priorSigma = max(spread / np.sqrt(2), self.MIN_PRIOR_SIGMA)
+
+		def scores(level, blockRows, blockCols):
+			# bound (exact score at level 0) of the blocks whose smallest translations are blockRows, blockCols,
+			# counted from (-radius, -radius). The prior is bounded by its value at the block's translation
+			# closest to the estimate
+			self.STATS['nodes'] += len(blockRows)
+			size = 1 << level
+			closestRows = np.clip(radius, blockRows, blockRows + size - 1) - radius
+			closestCols = np.clip(radius, blockCols, blockCols + size - 1) - radius
+			logPrior = -(np.square(closestRows) + np.square(closestCols)) / (2.0 * priorSigma ** 2)
+			return tables[level][blockRows[:, None] + baseRows, blockCols[:, None] + baseCols].sum(axis=1) + logPrior
+
+		bestShift = np.array([radius, radius])
+		bestScore = scores(0, bestShift[:1], bestShift[1:])[0] + self.MARGIN
+
+		# depth first, most promising block first, skipping blocks that cannot beat the best translation so far
+		level = self.NUM_LEVELS - 1
+		starts = np.arange(0, 2 * radius + 1, blockSize)
+		blockRows, blockCols = [block.ravel() for block in np.meshgrid(starts, starts, indexing='ij')]
+		bounds = scores(level, blockRows, blockCols)
+		order = np.argsort(bounds)
+		stack = [(bounds[i], level, blockRows[i], blockCols[i]) for i in order]
+		while stack:
+			bound, level, blockRow, blockCol = stack.pop()
+			if bound <= bestScore:
+				continue
+			if level == 0:
+				bestScore, bestShift = bound, np.array([blockRow, blockCol])
+				continue
+
+			half = 1 << (level - 1)
+			childRows = np.array([blockRow, blockRow, blockRow + half, blockRow + half])
+			childCols = np.array([blockCol, blockCol + half, blockCol, blockCol + half])
+			inWindow = (childRows <= 2 * radius) & (childCols <= 2 * radius)
+			childRows, childCols = childRows[inWindow], childCols[inWindow]
+			childBounds = scores(level - 1, childRows, childCols)
+			for i in np.argsort(childBounds):
+				stack.append((childBounds[i], level - 1, childRows[i], childCols[i]))
+
+		shift = bestShift - radius
+		self.STATS['shift'] = (int(shift[0]), int(shift[1]))
+		return estimate + shift
+
+
+	def getStats(self):
+		""" Returns the number of blocks scored and the translation found by the last match
+		"""
+		return self.STATS
@@ -3,6 +3,8 @@ import numpy as np
 import math
 import random
 from conv_to_bin_mat import ConvBinMap
+from RayCaster import RayCaster
+from OccupancyPyramid import OccupancyPyramid
 
 
 class Sensor:
@@ -12,7 +14,6 @@ class Sensor:
 		self.MAX_RANGE = 8 #meters
 		self.APERTURE_ANGLE = 360 #degrees
 		self.ANGULAR_RESOLUTION = 90 #degrees
-		self.RANGE_RESOLUTION = trueMap.getScale() #range resolution need not be better than plan scale
 		self.MAP_DIMS = trueMap.getDimensions()
 		self.MAP_OBJ = trueMap
 		
@@ -32,39 +33,55 @@ class Sensor:
 
 		self.NOISE_MODEL = sensor_noise # sensor noise is the standard deviation of a Gaussian noise model
 
+		# unit [dy, dx] direction of each beam (rows grow downwards, hence the minus sign) and the max range in cells,
+		# for walking the grid with the RayCaster
+		self.SENSOR_DIRECTIONS = np.column_stack((-np.sin(self.sensorAngles), np.cos(self.sensorAngles)))
+		self.MAX_RANGE_CELLS = self.MAX_RANGE / float(self.MAP_SCALE)
+		self.RANGE_TABLE = None # optional precomputed RangeTable, see useRangeTable
+
+		# max-pooled occupancy pyramid, so that rays skip across open space instead of walking it pixel by pixel.
+		# A tiled map is walked directly, since the pyramid would hold the whole map in memory
+		self.PYRAMID = None if trueMap.isTiled() else OccupancyPyramid(self.TRUE_MAP)
+
 		print "Sensor Initialized"
 
 
-	# returns an np array (vector) of distances corresponding to each of the sensor angles. Returns MAX_RANGE or higher if no wall in range
+	# returns a list of distances corresponding to each of the sensor angles. Returns MAX_RANGE if no wall in range
 	def getTrueDistances(self, truePosition):
 		# truePosition should be of the form [y, x]
-		y = truePosition[0]
-		x = truePosition[1]
-
 		sensorDistances = [0]*len(self.sensorAngles)
-		# return a distance associated with each scan angle
+		# each ray walks the grid from the center of the robot's cell and stops at the first wall
 		for angle in range(len(self.sensorAngles)):
-			# cast a ray increasingly farther out and check the pixel value at its endpoint. 
-			# distance is point at which wall is hit or distance maxes out
-			for distance in np.linspace(0, self.MAX_RANGE, self.MAX_RANGE/self.RANGE_RESOLUTION): # distance here is in meters
-				dx = distance * math.cos(self.sensorAngles[angle] % (2 * math.pi))
-				dy = -distance * math.sin(self.sensorAngles[angle] % (2 * math.pi))
-				# keep in mind np array accessed [row, col]
-
-
-				# divide dy and dx by scale to convert meters
-				y_pos = y+int(dy/self.MAP_SCALE)
-				x_pos = x+int(dx/self.MAP_SCALE)
-
-				# Map limits enforced
-				x_pos, y_pos = self.MAP_OBJ.imposeMapLimits(x_pos, y_pos)
-
-				if self.TRUE_MAP[y_pos][x_pos] == 1 or distance >= self.MAX_RANGE:
-					sensorDistances[angle] = distance
-					break
+			if self.PYRAMID is not None:
+				distance = RayCaster.castRayPyramid(self.PYRAMID, truePosition, self.SENSOR_DIRECTIONS[angle], self.MAX_RANGE_CELLS)
+			else:
+				distance = RayCaster.castRay(self.TRUE_MAP, truePosition, self.SENSOR_DIRECTIONS[angle], self.MAX_RANGE_CELLS)
+			# divide by scale to convert cells to meters
+			sensorDistances[angle] = self.MAX_RANGE if distance >= self.MAX_RANGE_CELLS else distance * self.MAP_SCALE
 
 		return sensorDistances
 
+	# Batch version of getTrueDistances. Takes an (N,2) array of [y, x] positions and returns an (N, beams) np array
+	# of distances. Uses the precomputed range table when one has been loaded with useRangeTable
+	def getTrueDistancesBatch(self, truePositions):
+		if self.RANGE_TABLE is not None:
+			return self.RANGE_TABLE.lookup(truePositions)
+		return self.castTrueDistancesBatch(truePositions)
+
+	# Casts the rays of an (N,2) array of [y, x] positions, all poses and beams at once. Returns an (N, beams) np array
+	def castTrueDistancesBatch(self, truePositions):
+		if self.PYRAMID is not None:
+			distances = RayCaster.castRaysPyramid(self.PYRAMID, truePositions, self.SENSOR_DIRECTIONS, self.MAX_RANGE_CELLS)
+		else:
+			distances = RayCaster.castRays(self.TRUE_MAP, truePositions, self.SENSOR_DIRECTIONS, self.MAX_RANGE_CELLS)
+		return np.where(distances >= self.MAX_RANGE_CELLS, self.MAX_RANGE, distances * self.MAP_SCALE)
+
+	def useRangeTable(self, rangeTable):
+		""" Answer getTrueDistancesBatch from a precomputed RangeTable instead of casting rays.
+			Pass None to go back to casting.
+		"""
+		self.RANGE_TABLE = rangeTable
+
 	# Adds noise to sensor return values based on a noise model
 	def getNoisyDistances(self, truePosition):
 		distances = self.getTrueDistances(truePosition)
@@ -91,6 +108,9 @@ class Sensor:
 	def getNoise(self):
 		return self.NOISE_MODEL
 
+	def getMaxRange(self):
+		return self.MAX_RANGE
+
 	def getSensorAngles(self):
 		return self.sensorAngles
 
@@ -2,10 +2,13 @@ from Odometry import Odometry
 from ParticleFilter import ParticleFilter
 from Sensor import Sensor
 from TrueMap import TrueMap
+from RangeTable import RangeTable
 from visualization import Visualization
 import time
 import math
 from RobotMap import RobotMap
+from ParticleMaps import ParticleMaps
+from ScanMatcher import ScanMatcher
 
 
 
@@ -22,11 +25,23 @@ if __name__ == '__main__':
 	# the_true_map = TrueMap()
 	viz = Visualization(the_true_map, start_x=initx, start_y=inity)
 	sensor = Sensor(the_true_map)
+	sensor.useRangeTable(RangeTable(the_true_map, sensor).load())  # true ranges are looked up instead of cast
 	odom = Odometry(the_true_map, start_x=initx, start_y=inity)
 	part_filt = ParticleFilter(the_true_map, sensor, odom, numParticles=100)
 	part_filt.initParticlesSpecific(initx, inity)
 
-	the_robot_map = RobotMap(part_filt, posteriorProb=the_true_map.getOccupancyFraction())
+	# one map built from the particle mean, or (FastSLAM style) one map per particle, built from its own pose
+	per_particle_maps = False
+	# refine the particle mean against the map before each scan is added to it (single map only). Off by default:
+	# with this sensor the matcher does not measurably lower the pose error yet
+	scan_matching = False
+	scan_matcher = None
+	if per_particle_maps:
+		the_robot_map = ParticleMaps(part_filt, posteriorProb=the_true_map.getOccupancyFraction(), dimensions=the_true_map.getDimensions())
+	else:
+		the_robot_map = RobotMap(part_filt, posteriorProb=the_true_map.getOccupancyFraction(), dimensions=the_true_map.getDimensions())
+		if scan_matching:
+			scan_matcher = ScanMatcher(the_robot_map)
 
 
 	scale = 7  # number of pixels to move each time a movement is given
@@ -59,11 +74,18 @@ if __name__ == '__main__':
 		part_filt.weightParticles(sensor_readings)
 
 		# Update the robot map using particle filter knowledge
-		the_robot_map.updateMap(sensor_angles, sensor_readings)
+		if scan_matcher is not None:
+			matched_pose = scan_matcher.match(sensor_angles, sensor_readings, part_filt.getSupposedLocation(),
+				part_filt.getPoseStatistics().getSpread())
+			the_robot_map.updateMap(sensor_angles, sensor_readings, pose=matched_pose)
+		else:
+			the_robot_map.updateMap(sensor_angles, sensor_readings)
 
 		endTime = time.time()
 
 		print "Time per particle without visualization: ", (endTime-startTime)/part_filt.getNumParticles()
+		stats = part_filt.getStepStats()
+		print "Resampled: ", stats['resampled'], " (", stats['resamples'], " of ", stats['updates'], " updates), effective sample size: ", stats['ess']
 		# visualize the particles every 10 steps
 		# if step_count % 10 == 0:
 		# 	viz.replot_particles(part_filt.getParticleLocations())
@@ -75,6 +97,6 @@ if __name__ == '__main__':
 
 		viz.display_plot()
 		if (step_count % 10) == 0:
-			viz.display_a_matrix(the_robot_map.getMap())
+			viz.display_a_matrix(the_robot_map.getDisplayMatrix())
 		
 		endTime = time.time()
@@ -0,0 +1,191 @@
+# Tiled, lazily loaded occupancy grid for very large floorplans. The map is stored on disk as fixed-size square tiles
+# in a memory-mapped .npy store, and only the tiles that are actually read are copied into memory, in an LRU cache
+# of at most MAX_TILES tiles. A TiledGrid indexes like the 2D np array it replaces (grid[row, col] with ints or
+# arrays, grid.shape), so ray casting and collision checks do not need to know which one they have.
+import numpy as np
+import os
+from conv_to_bin_mat import ConvBinMap
+
+
+class TiledGrid:
+
+	def __init__(self, floorplan, tile_size=256, max_tiles=64):
+		self.TILE_SIZE = tile_size
+		self.MAX_TILES = max_tiles
+		self.STORE_PATH, self.COUNTS_PATH = TiledGrid.store_paths(floorplan, tile_size)
+		if not (os.path.exists(self.STORE_PATH) and os.path.exists(self.COUNTS_PATH)):
+			TiledGrid.build_store(floorplan, tile_size)
+
+		# (tile_rows, tile_cols, tile_size, tile_size) memory-mapped store, and the number of legal cells of each tile
+		self.STORE = np.load(self.STORE_PATH, mmap_mode='r')
+		self.LEGAL_COUNTS = np.load(self.COUNTS_PATH)
+		self.TILE_ROWS, self.TILE_COLS = self.LEGAL_COUNTS.shape[:2]
+
+		# the real map dimensions, the store is padded with walls up to a whole number of tiles
+		self.shape = tuple(int(dim) for dim in np.load(self.COUNTS_PATH[:-len(".npy")] + ".shape.npy"))
+		self.size = self.shape[0] * self.shape[1]
+		self.ndim = 2
+		self.dtype = self.STORE.dtype
+
+		# LRU tile cache: MAX_TILES slots of tile memory, the slot each tile is loaded in (-1 if it is not) and the
+		# tick of the read that last used each slot. Reads look tiles up with array operations rather than per cell
+		self.SLOTS = np.empty((max_tiles, tile_size, tile_size), dtype=self.dtype)
+		self.SLOT_OF = np.full(self.TILE_ROWS * self.TILE_COLS, -1, dtype=np.int64)
+		self.TILE_IN_SLOT = np.full(max_tiles, -1, dtype=np.int64)
+		self.LAST_USED = np.zeros(max_tiles, dtype=np.int64)
+		self.CLOCK = 0
+		self.TILE_LOADS = 0  # number of tiles read from the store, for measuring the cache
+
+
+	@staticmethod
+	def store_paths(floorplan, tile_size):
+		""" Returns the paths of the tile store and the tile legal counts of a floorplan. They sit next to the
+			map_to_mat cache of the floorplan and carry the same hash, so editing the image invalidates them.
+		"""
+		base = ConvBinMap.cache_path(floorplan)[:-len(".npy")]
+		return base + ".tiles%d.npy" % tile_size, base + ".tilecounts%d.npy" % tile_size
+
+
+	@staticmethod
+	def build_store(floorplan, tile_size):
+		""" Splits the floorplan's occupancy grid into tiles and writes the tile store, the legal cell count of
+			each tile and the map dimensions. Builds are streamed one row of tiles at a time.
+		"""
+		grid = ConvBinMap.map_to_mat(floorplan)
+		rows, cols = grid.shape
+		tile_rows = -(-rows // tile_size)
+		tile_cols = -(-cols // tile_size)
+		store_path, counts_path = TiledGrid.store_paths(floorplan, tile_size)
+
+		tmp_path = store_path[:-len(".npy")] + ".tmp" + str(os.getpid()) + ".npy"
+		store = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(tile_rows, tile_cols, tile_size, tile_size))
+		for tile_row in range(tile_rows):
+			# pad the last row and column of tiles with walls
+			band = np.ones((tile_size, tile_cols * tile_size), dtype=np.uint8)
+			rows_in_band = grid[tile_row * tile_size:(tile_row + 1) * tile_size]
+			band[:len(rows_in_band), :cols] = (rows_in_band == 1)
+			store[tile_row] = band.reshape(tile_size, tile_cols, tile_size).swapaxes(0, 1)
+		counts = np.sum(store == 0, axis=(2, 3))
+		store.flush()
+		del store
+		os.rename(tmp_path, store_path)
+
+		np.save(counts_path[:-len(".npy")] + ".shape.npy", np.array([rows, cols]))
+		np.save(counts_path, counts)
+		ConvBinMap.remove_stale_caches(floorplan)
+
+
+	def loadTile(self, tile_id):
+		""" Copies a tile from the store into a free slot, or else the least recently used slot, and returns the
+			slot. Returns None if every slot is in use by the current read.
+		"""
+		slot = int(np.argmin(self.LAST_USED))
+		if self.LAST_USED[slot] == self.CLOCK:
+			return None
+		evicted = self.TILE_IN_SLOT[slot]
+		if evicted >= 0:
+			self.SLOT_OF[evicted] = -1
+
+		self.SLOTS[slot] = self.STORE[divmod(int(tile_id), self.TILE_COLS)]
+		self.TILE_LOADS += 1
+		self.SLOT_OF[tile_id] = slot
+		self.TILE_IN_SLOT[slot] = tile_id
+		self.LAST_USED[slot] = self.CLOCK
+		return slot
+
+
+	def getTile(self, tile_row, tile_col):
+		""" Returns the (tile_size, tile_size) tile, from the cache or loaded from the store. The tile is a view
+			of the cache, so copy it to keep it past later reads.
+		"""
+		self.CLOCK += 1
+		tile_id = tile_row * self.TILE_COLS + tile_col
+		slot = self.SLOT_OF[tile_id]
+		if slot < 0:
+			slot = self.loadTile(tile_id)
+		self.LAST_USED[slot] = self.CLOCK
+		return self.SLOTS[slot]
+
+
+	def __getitem__(self, index):
+		""" grid[row, col] with int coordinates returns one cell, with np arrays of coordinates (of any, equal
+			shape) returns an array of cells.
+		"""
+		rows, cols = index
+		if np.isscalar(rows) and np.isscalar(cols):
+			self.checkBounds(rows, cols)
+			return self.getTile(rows // self.TILE_SIZE, cols // self.TILE_SIZE)[rows % self.TILE_SIZE, cols % self.TILE_SIZE]
+
+		rows, cols = np.broadcast_arrays(np.asarray(rows), np.asarray(cols))
+		self.checkBounds(rows, cols)
+		tile_ids = (rows // self.TILE_SIZE) * self.TILE_COLS + cols // self.TILE_SIZE
+
+		self.CLOCK += 1
+		slots = self.SLOT_OF[tile_ids]
+		present = slots >= 0
+		self.LAST_USED[slots[present]] = self.CLOCK
+		if not np.all(present):
+			for tile_id in np.unique(tile_ids[~present]):
+				if self.loadTile(tile_id) is None:
+					# the read spans more tiles than the cache holds, so read it from the store directly
+					return self.STORE[rows // self.TILE_SIZE, cols // self.TILE_SIZE, rows % self.TILE_SIZE, cols % self.TILE_SIZE]
+			slots = self.SLOT_OF[tile_ids]
+		return self.SLOTS[slots, rows % self.TILE_SIZE, cols % self.TILE_SIZE]
+
+
+	def checkBounds(self, rows, cols):
+		# unlike np arrays, negative indices are errors rather than counting from the end
+		if np.any(rows < 0) or np.any(rows >= self.shape[0]) or np.any(cols < 0) or np.any(cols >= self.shape[1]):
+			raise IndexError("index out of bounds of the tiled map")
+
+
+	def __array__(self, dtype=None):
+		""" Materializes the whole map as a dense np array, for algorithms that need all of it at once
+			(e.g. the likelihood field's distance transform). This costs the full map's memory.
+		"""
+		dense = np.asarray(self.STORE).swapaxes(1, 2).reshape(self.TILE_ROWS * self.TILE_SIZE, self.TILE_COLS * self.TILE_SIZE)
+		dense = dense[:self.shape[0], :self.shape[1]]
+		return dense.astype(dtype) if dtype is not None else np.array(dense)
+
+
+	def getNumLegal(self):
+		return int(np.sum(self.LEGAL_COUNTS))
+
+
+	def sampleLegalPositions(self, count):
+		""" Returns a (count,2) array of distinct random [row, col] legal positions, or every legal position
+			(in random order) if count is at least the number of them. Only the tiles holding the chosen
+			positions are read.
+		"""
+		cumulative = np.cumsum(self.LEGAL_COUNTS.ravel())
+		numLegal = int(cumulative[-1]) if len(cumulative) else 0
+		count = min(count, numLegal)
+
+		# draw distinct ranks among all the legal cells. Beyond half of them, a shuffle of all the ranks is cheaper
+		# than rejecting repeats; below, random draws collide rarely enough that a few redraws of the repeats
+		# suffice, without materializing a list of every legal cell
+		if 2 * count > numLegal:
+			ranks = np.random.permutation(numLegal)[:count]
+		else:
+			ranks = np.unique(np.random.randint(0, numLegal, size=count))
+			while len(ranks) < count:
+				ranks = np.unique(np.concatenate((ranks, np.random.randint(0, numLegal, size=count - len(ranks)))))
+			ranks = np.random.permutation(ranks)
+
+		# which tile each rank falls in, and its rank among that tile's legal cells
+		tile_ids = np.searchsorted(cumulative, ranks, side='right')
+		ranks_in_tile = ranks - np.concatenate(([0], cumulative))[tile_ids]
+
+		positions = np.empty((count, 2), dtype=int)
+		for tile_id in np.unique(tile_ids):
+			tile_row, tile_col = divmod(int(tile_id), self.TILE_COLS)
+			legal_cells = np.flatnonzero(self.getTile(tile_row, tile_col).ravel() == 0)
+			in_tile = tile_ids == tile_id
+			cell_rows, cell_cols = np.divmod(legal_cells[ranks_in_tile[in_tile]], self.TILE_SIZE)
+			positions[in_tile, 0] = tile_row * self.TILE_SIZE + cell_rows
+			positions[in_tile, 1] = tile_col * self.TILE_SIZE + cell_cols
+		return positions
+
+
+	def getLoadedTileCount(self):
+		return int(np.sum(self.TILE_IN_SLOT >= 0))
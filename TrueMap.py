@@ -1,22 +1,43 @@
+import numpy as np
 from conv_to_bin_mat import ConvBinMap
+from TiledMap import TiledGrid
 
 class TrueMap:
 	
-	def __init__(self, floorplan = "BinaryMaps/MD_MINI_binary.png", plan_scale = .04805):
+	def __init__(self, floorplan = "BinaryMaps/MD_MINI_binary.png", plan_scale = .04805, tiled = False, tile_size = 256, max_tiles = 64):
 		# Store true map. The map is indexed (0,0) in the top left with the form (y,x) (aka row, column)
 		self.FLOORPLAN = floorplan
-		self.TRUE_MAP = ConvBinMap.map_to_mat(floorplan) # returns np binary array of floorplan
 		self.SCALE = plan_scale # meters per pixel
-
-		# a list of tuples of legal positions
-		self.LEGAL_POS = []
-		rows,cols = self.TRUE_MAP.shape
-		for row in range(rows):
-			for col in range(cols):
-				if self.TRUE_MAP[row][col] != 1:
-					self.LEGAL_POS.append((row,col))
-
-		self.NUM_LEGAL_POS = len(self.LEGAL_POS)
+		self.TILED = tiled
+
+		# a list of tuples of legal positions, only built if asked for (see getLegalPositions)
+		self.LEGAL_POS = None
+
+		if tiled:
+			# for floorplans too large to hold in memory: the map is read tile by tile from a memory-mapped tile
+			# store, keeping at most max_tiles tile_size x tile_size tiles loaded (see TiledGrid). The legal index
+			# would cost as much as the map, so it is only built if asked for (see getLegalIndex)
+			self.TRUE_MAP = TiledGrid(floorplan, tile_size, max_tiles)
+			self.LEGAL_INDEX = None
+			self.NUM_LEGAL_POS = self.TRUE_MAP.getNumLegal()
+			return
+
+		# stored compactly as one uint8 per pixel: 1 for a wall or obstacle, 0 for anything else.
+		# A pure 0/1 matrix is used as is, so that the memory-mapped map cache is not copied
+		self.TRUE_MAP = ConvBinMap.map_to_mat(floorplan) # np binary array of floorplan
+		if self.TRUE_MAP.dtype != np.uint8 or self.TRUE_MAP.max() > 1:
+			self.TRUE_MAP = (self.TRUE_MAP == 1).astype(np.uint8)
+
+		# compact index of the legal positions: their flat (row * cols + col) indices into the map, in row-major order.
+		self.LEGAL_INDEX = self.buildLegalIndex(self.TRUE_MAP)
+		self.NUM_LEGAL_POS = len(self.LEGAL_INDEX)
+
+	@staticmethod
+	def buildLegalIndex(grid):
+		""" Returns the flat indices of the 0 cells of grid. int32 is enough for any map under 2**31 pixels
+		"""
+		index_type = np.int32 if grid.size < np.iinfo(np.int32).max else np.int64
+		return np.flatnonzero(np.asarray(grid).ravel() == 0).astype(index_type)
 
 	def getFloorPlanFile(self):
 		""" Returns the filepath to the floorplan
@@ -32,9 +53,41 @@ class TrueMap:
 		""" Returns a list of tuples of rows and cols of all of the legal positions (elements in the 
 			matrix that are not equal to 1, where 1 indicates the presence of a wall or obstacle).
 			e.g. self.LEGAL_POS = [(row1,col1), (row2,col2)]
+
+			The list costs tens of bytes per legal position, so it is built on the first call only;
+			prefer getLegalIndex.
 		"""
+		if self.LEGAL_POS is None:
+			rows, cols = np.divmod(self.getLegalIndex(), self.TRUE_MAP.shape[1])
+			self.LEGAL_POS = zip(rows.tolist(), cols.tolist())
 		return self.LEGAL_POS
 
+	def getLegalIndex(self):
+		""" Returns a np array of the flat indices (row * map_cols + col) of all of the legal positions,
+			in the same order as getLegalPositions. np.divmod(index, map_cols) recovers (row, col).
+
+			On a tiled map this reads the whole map and the index is as large as the map itself;
+			use sampleLegalPositions where possible.
+		"""
+		if self.LEGAL_INDEX is None:
+			self.LEGAL_INDEX = self.buildLegalIndex(self.TRUE_MAP)
+		return self.LEGAL_INDEX
+
+	def sampleLegalPositions(self, count):
+		""" Returns a (count,2) np array of [row, col] of distinct legal positions chosen uniformly at random.
+			On a tiled map only the tiles the positions fall in are read.
+		"""
+		if self.TILED:
+			return self.TRUE_MAP.sampleLegalPositions(count)
+		chosen = self.LEGAL_INDEX[np.random.permutation(self.NUM_LEGAL_POS)[:count]]
+		return np.column_stack(np.divmod(chosen, self.TRUE_MAP.shape[1])).astype(int)
+
+	def getNumLegalPositions(self):
+		return self.NUM_LEGAL_POS
+
+	def isTiled(self):
+		return self.TILED
+
 	def getTrueMap(self):
 		return self.TRUE_MAP
 
@@ -62,11 +115,18 @@ class TrueMap:
 
 		return x_pos, y_pos
 
+	def imposeMapLimitsArray(self, x_pos, y_pos):
+		""" Vectorized imposeMapLimits for np arrays of x and y coordinates. Returns new clipped arrays.
+		"""
+		map_rows, map_cols = self.getDimensions()
+
+		return np.clip(x_pos, 0, map_cols - 1), np.clip(y_pos, 0, map_rows - 1)
+
 	def getOccupancyFraction(self):
 		""" Returns the fraction of occupied (black, 1) pixels on the map
 		"""
 		total_pixels = self.TRUE_MAP.size
-		num_legal = len(self.LEGAL_POS)
+		num_legal = self.NUM_LEGAL_POS
 		num_occupied = total_pixels - num_legal
 
 		return num_occupied / float(total_pixels)
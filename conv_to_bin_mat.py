@@ -1,47 +1,123 @@
 from PIL import Image
+from PIL.PngImagePlugin import PngInfo
 import numpy as np
 import os
+import glob
+import hashlib
+import argparse
+import multiprocessing
 import scipy.misc
 
 
+# image formats picked up by ConvBinMap.convert_directory
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+def _convert_one(args):
+	# module level so that it can be sent to a process pool
+	source_path, dest_path, threshold, force = args
+	if not force and ConvBinMap.is_up_to_date(source_path, dest_path, threshold):
+		return source_path, "up to date"
+	ConvBinMap.convert_image(source_path, dest_path, threshold)
+	return source_path, "converted"
+
 
 class ConvBinMap:
 
 	@staticmethod
-	def map_to_binary_image():
+	def map_to_binary_image(source_im=None, threshold=128):
 		""" Converts an image stored in the 'SourceMaps' directory
 		    into a black and white image (0 = black, 255 = white) that is 
 		    then stored in the 'BinaryMaps' directory.
 
 		    User is prompted to enter the filename of the chosen map first (e.g. MD_0.png)
+		    unless it is given as source_im.
 		    Output file is named the same thing as the input file name, but with '_binary' 
 		    appended to the end.
 		"""
-		source_im = raw_input("Enter the path of your file: ")
+		if source_im is None:
+			source_im = raw_input("Enter the path of your file: ")
 		# print source_im
 
-		col = Image.open("SourceMaps/" + source_im)
+		ConvBinMap.convert_image("SourceMaps/" + source_im, "BinaryMaps/" + ConvBinMap.binary_name(source_im), threshold)
+
+
+	@staticmethod
+	def binary_name(source_im):
+		""" Returns the file name of the binary image for a source image, e.g. MD_0.png -> MD_0_binary.png
+		"""
+		source_im_wo_ext = os.path.splitext(os.path.basename(source_im))[0]
+		return source_im_wo_ext + "_binary.png"
+
+
+	@staticmethod
+	def convert_image(source_path, dest_path, threshold=128):
+		""" Converts the image at source_path to black (0) and white (255), saves it as dest_path and
+			writes its occupancy matrix cache (see map_to_mat), so that the first load of the map is fast too.
+			Pixels darker than threshold become black. The threshold is recorded in the image's metadata.
+		"""
+		col = Image.open(source_path)
 		gray = col.convert('L')
 
 		# converting pixels to pure black or white
 		bw = np.asarray(gray).copy()
 
-		# Pixel range is 0...255, 256/2 = 128
-		bw[bw < 128] = 0    # Black
-		bw[bw >= 128] = 255 # White
+		# Pixel range is 0...255, default threshold 256/2 = 128
+		black = bw < threshold
+		bw[black] = 0    # Black
+		bw[~black] = 255 # White
 
 		# Now we put it back in Pillow/PIL land
 		imfile = Image.fromarray(bw)
+		info = PngInfo()
+		info.add_text("threshold", str(threshold))
+		imfile.save(dest_path, pnginfo=info)
 
-		source_im_wo_ext = os.path.splitext(source_im)[0]
-		out_im = source_im_wo_ext + "_binary.png"
-		# print out_im
+		# black is obstacle (1), white is no obstacle (0), as map_to_mat would convert it
+		ConvBinMap.write_cache(dest_path, black.astype(np.uint8))
 
-		imfile.save("BinaryMaps/" + out_im)
+
+	@staticmethod
+	def is_up_to_date(source_path, dest_path, threshold=128):
+		""" A binary image is up to date if it is newer than its source, was converted with the same threshold
+			and its matrix cache exists. Images without a recorded threshold count as converted with the default.
+		"""
+		if not os.path.exists(dest_path) or os.path.getmtime(dest_path) < os.path.getmtime(source_path):
+			return False
+		if Image.open(dest_path).info.get("threshold", "128") != str(threshold):
+			return False
+		return os.path.exists(ConvBinMap.cache_path(dest_path))
 
 
 	@staticmethod
-	def map_to_mat(map_image_path):
+	def convert_directory(source_dir="SourceMaps", dest_dir="BinaryMaps", threshold=128, processes=None, force=False):
+		""" Converts every image in source_dir into a binary image (and its matrix cache) in dest_dir, in a
+			pool of processes (one per core by default). Images whose binary image is already up to date
+			(see is_up_to_date) are skipped unless force is set.
+
+			Returns a list of (source path, "converted" or "up to date") tuples.
+		"""
+		if not os.path.isdir(dest_dir):
+			os.makedirs(dest_dir)
+
+		jobs = []
+		for source_im in sorted(os.listdir(source_dir)):
+			if os.path.splitext(source_im)[1].lower() in SOURCE_EXTENSIONS:
+				dest_path = os.path.join(dest_dir, ConvBinMap.binary_name(source_im))
+				jobs.append((os.path.join(source_dir, source_im), dest_path, threshold, force))
+
+		if processes == 1 or len(jobs) <= 1:
+			return map(_convert_one, jobs)
+
+		pool = multiprocessing.Pool(processes)
+		try:
+			return pool.map(_convert_one, jobs)
+		finally:
+			pool.close()
+			pool.join()
+
+
+	@staticmethod
+	def map_to_mat(map_image_path, use_cache=True):
 		""" Uses a black and white png image produced by map_to_binary_image() and converts it 
 			into a matrix of the same dimensions as the image (there is a one-to-one mapping 
 			of pixels to matrix elements).
@@ -54,24 +130,111 @@ class ConvBinMap:
 
 			Takes a string as an argument (the name of the black and white image).
 			Returns a numpy matrix of zeros and ones, indexed as: map_matrix[rows][cols]
-			
+
+			The converted matrix is cached in a .npy file next to the image (see cache_path), and later
+			calls memory-map the cache (read-only) instead of decoding the image again.
+		"""
+		if not use_cache:
+			return ConvBinMap.image_to_mat(map_image_path)
+
+		cache_file = ConvBinMap.cache_path(map_image_path)
+		if not os.path.exists(cache_file):
+			ConvBinMap.write_cache(map_image_path, ConvBinMap.image_to_mat(map_image_path))
+
+		return np.load(cache_file, mmap_mode='r')
+
+
+	@staticmethod
+	def image_to_mat(map_image_path):
+		""" Decodes the image and converts it as described in map_to_mat, without any caching
 		"""
 		map_matrix = scipy.misc.imread(map_image_path)
 
-		# map_matrix[map_matrix > 200] = 0 # no obstacle
-		# map_matrix[map_matrix < 50] = 1 # obstacle
-			
-		for (x,y), value in np.ndenumerate(map_matrix):
-			if map_matrix[x][y] == 255:
-				map_matrix[x][y] = 0  # no obstacle
-			elif map_matrix[x][y] == 0:
-				map_matrix[x][y] = 1  # obstacle
+		obstacle = map_matrix == 0
+		map_matrix[map_matrix == 255] = 0  # no obstacle
+		map_matrix[obstacle] = 1  # obstacle
 
 		return map_matrix
 
 
+	@staticmethod
+	def cache_path(map_image_path):
+		""" Returns the path of the cached matrix of an image: the image path with its extension replaced by
+			the first 16 hex digits of the SHA-1 of the image file (see image_digest) and '.npy'.
+			Editing the image changes the hash, so a stale cache is never used.
+		"""
+		return os.path.splitext(map_image_path)[0] + "." + ConvBinMap.image_digest(map_image_path) + ".npy"
+
+
+	@staticmethod
+	def image_digest(map_image_path):
+		""" Returns the first 16 hex digits of the SHA-1 of the image file. The digest is recorded in a .sha1
+			file next to the image along with the image's size and modification time, and the image is only
+			hashed again once either of them changes.
+		"""
+		stat = os.stat(map_image_path)
+		stamp = "%d %r" % (stat.st_size, stat.st_mtime)
+		digest_file = os.path.splitext(map_image_path)[0] + ".sha1"
+		try:
+			with open(digest_file) as recorded:
+				recorded_stamp, digest = recorded.read().rsplit(" ", 1)
+			if recorded_stamp == stamp and len(digest) == 16:
+				return digest
+		except (IOError, ValueError):
+			pass
+
+		with open(map_image_path, 'rb') as image_file:
+			digest = hashlib.sha1(image_file.read()).hexdigest()[:16]
+		try:
+			with open(digest_file, 'w') as recorded:
+				recorded.write(stamp + " " + digest)
+		except IOError:
+			pass  # e.g. a read-only map directory, the image is then hashed on every load
+		return digest
+
+
+	@staticmethod
+	def remove_stale_caches(map_image_path):
+		""" Removes the caches of earlier versions of the image: the matrix caches, and the files derived from
+			them (e.g. TiledGrid tile stores), which carry the cache's hash right after the image name too
+		"""
+		cache_hash = ConvBinMap.image_digest(map_image_path)
+		prefix = os.path.splitext(map_image_path)[0] + "."
+		for stale_file in glob.glob(prefix + "*.npy"):
+			file_hash = stale_file[len(prefix):].split(".")[0]
+			if file_hash != cache_hash and len(file_hash) == 16:
+				os.remove(stale_file)
+
+
+	@staticmethod
+	def write_cache(map_image_path, map_matrix):
+		""" Saves map_matrix as the cache of the image, and removes caches of earlier versions of the image
+		"""
+		cache_file = ConvBinMap.cache_path(map_image_path)
+		ConvBinMap.remove_stale_caches(map_image_path)
+
+		# write to a temporary file first so that a reader never sees a partially written cache
+		tmp_file = cache_file[:-len(".npy")] + ".tmp" + str(os.getpid()) + ".npy"
+		np.save(tmp_file, map_matrix)
+		os.rename(tmp_file, cache_file)
+
+
 # For testing with the terminal:
+#     python conv_to_bin_mat.py                   prompts for one file in SourceMaps
+#     python conv_to_bin_mat.py --batch           converts all of SourceMaps into BinaryMaps
 if __name__ == '__main__':
-	ConvBinMap.map_to_binary_image()
+	parser = argparse.ArgumentParser(description="Convert floorplan images into binary maps")
+	parser.add_argument('--batch', action='store_true', help="convert a whole directory without prompting")
+	parser.add_argument('--source', default="SourceMaps", help="directory of source floorplans (batch mode)")
+	parser.add_argument('--dest', default="BinaryMaps", help="directory for the binary maps (batch mode)")
+	parser.add_argument('--threshold', type=int, default=128, help="gray level below which a pixel is an obstacle")
+	parser.add_argument('--processes', type=int, default=None, help="worker processes (default: one per core)")
+	parser.add_argument('--force', action='store_true', help="convert even if the binary map is up to date")
+	args = parser.parse_args()
+
+	if args.batch:
+		for source_path, status in ConvBinMap.convert_directory(args.source, args.dest, args.threshold, args.processes, args.force):
+			print source_path, status
+	else:
+		ConvBinMap.map_to_binary_image(threshold=args.threshold)
 	# ConvBinMap.map_to_mat('BinaryMaps/MD_0_binary.png')
-
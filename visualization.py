@@ -90,12 +90,8 @@ class Visualization:
 			makes transition time between states slower).  Default to the first 100 particles.  If there are 
 			fewer than numtoplot particles, then it plots all of them.
 		"""
-		# Overlay particles and the floorplan
-		if len(particlelist) <= numtoplot:
-			self.PARTICLES = particlelist
-		else:
-			for i in range(numtoplot):
-				self.PARTICLES.append(particlelist[i])
+		# Overlay particles and the floorplan. Slicing works for both lists and the filter's np array
+		self.PARTICLES = particlelist[:numtoplot]
 
 
 	def move_robot(self, move_comm='k', new_coord=None, move_comm_list=[], move_coord_list = []):
@@ -233,7 +229,7 @@ class Visualization:
 		# Here's where the particles are actually plotted
 		# put a red dot, size self.PSIZE, but actually consists of only its coordinate (new_x, new_y):
 		# scatter() takes values in x, y order (so the opposite of the numpy array ordering)
-		if self.PARTICLES:
+		if len(self.PARTICLES):
 			for (py,px) in self.PARTICLES:
 				plt.scatter(px, py, c='r', s=self.PSIZE)
 